@@ -0,0 +1,215 @@
+"""Benchmarks for the alignment hot paths on synthetic networks.
+
+Times get_corr_cnn_filters, bipartite_matching, crossover_method, weight_matching, permute_cnn, transplant_neurons,
+transplant_all_neurons, identify_interesting_neurons and arithmetic_crossover on random activations and weight lists
+shaped like keras_model_cnn at several widths, and records the peak memory allocated by each call. Everything runs on
+the CPU and no dataset is needed.
+
+    python benchmarks/bench_alignment.py --output bench_results.json
+    python benchmarks/bench_alignment.py --compare old_results.json bench_results.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "-1")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from matching import MATCHING_ENGINES
+from permutation_plan import NeuronLayer
+from permutation_plan import PermutationPlan
+from utils import arithmetic_crossover
+from utils import bipartite_matching
+from utils import crossover_method
+from utils import get_corr_cnn_filters
+from utils import identify_interesting_neurons
+from utils import permute_cnn
+from utils import transplant_all_neurons
+from utils import transplant_neurons
+from weight_matching import weight_matching
+
+
+def synthetic_network(width, rng, num_conv_layers=4, kernel_size=5, flatten_positions=64, dense_size=64,
+                      output_size=10):
+    # weight list and permutation plan laid out like keras_model_cnn: conv kernel, bias and 4 batch norm tensors per
+    # block, then the flattened dense layer and the output layer
+    weights_list = []
+    layers = []
+    in_channels = 3
+    for layer in range(num_conv_layers):
+        offset = len(weights_list)
+        weights_list.append(rng.standard_normal((kernel_size, kernel_size, in_channels, width), dtype=np.float32))
+        weights_list += [rng.standard_normal(width, dtype=np.float32) for _ in range(5)]
+        in_channels = width
+
+        flatten_size = flatten_positions if layer == num_conv_layers - 1 else None
+        in_axis = 0 if layer == num_conv_layers - 1 else 2
+        layers.append(NeuronLayer(width, [(offset, 3)] + [(offset + index, 0) for index in range(1, 6)], offset + 6,
+                                  in_axis, flatten_size))
+
+    offset = len(weights_list)
+    weights_list.append(rng.standard_normal((flatten_positions * width, dense_size), dtype=np.float32))
+    weights_list.append(rng.standard_normal(dense_size, dtype=np.float32))
+    weights_list.append(rng.standard_normal((dense_size, output_size), dtype=np.float32))
+    layers.append(NeuronLayer(dense_size, [(offset, 1), (offset + 1, 0)], offset + 2, 0, None))
+
+    return weights_list, PermutationPlan(layers)
+
+
+def synthetic_activations(batch_size, width, spatial_size, rng, num_conv_layers=4):
+    # correlated activation maps for two networks, plus the two dense layers get_corr_cnn_filters skips
+    list_one = []
+    list_two = []
+    for _ in range(num_conv_layers):
+        activations = rng.standard_normal((batch_size, spatial_size, spatial_size, width), dtype=np.float32)
+        noise = rng.standard_normal((batch_size, spatial_size, spatial_size, width), dtype=np.float32)
+        list_one.append(activations)
+        list_two.append(activations[..., rng.permutation(width)] + noise)
+
+    for size in [64, 10]:
+        list_one.append(rng.standard_normal((batch_size, size), dtype=np.float32))
+        list_two.append(rng.standard_normal((batch_size, size), dtype=np.float32))
+
+    return list_one, list_two
+
+
+def synthetic_self_correlation(width, rng, num_factors=8):
+    # neurons driven by a few shared factors, so that some of them are redundant
+    factors = rng.standard_normal((4 * width, num_factors))
+    activations = factors @ rng.standard_normal((num_factors, width)) + rng.standard_normal((4 * width, width))
+
+    return np.corrcoef(activations, rowvar=False)
+
+
+def measure(function, repeats, *args):
+    times = []
+    peak_bytes = 0
+    for _ in range(repeats):
+        tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            function(*args)
+        times.append(time.perf_counter() - start)
+        peak_bytes = max(peak_bytes, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    return {"repeats": repeats, "min_s": min(times), "median_s": float(np.median(times)), "peak_bytes": peak_bytes}
+
+
+def run(widths, batch_sizes, spatial_size, repeats, max_activation_bytes, seed):
+    rng = np.random.default_rng(seed)
+    records = []
+
+    def record(name, width, batch_size, function, *args):
+        result = measure(function, repeats, *args)
+        result.update({"function": name, "width": width, "batch_size": batch_size})
+        records.append(result)
+        print("%-30s width=%-5d batch=%-6s median=%.4fs peak=%.1fMB" % (name, width, batch_size, result["median_s"],
+                                                                        result["peak_bytes"] / 2 ** 20))
+
+    for width in widths:
+        weights_one, plan = synthetic_network(width, rng)
+        weights_two, _ = synthetic_network(width, rng)
+        num_layers = len(plan.layers) - 1
+
+        list_cross_corr = None
+        for batch_size in batch_sizes:
+            activation_bytes = 2 * 4 * batch_size * spatial_size ** 2 * width * 4
+            if activation_bytes > max_activation_bytes:
+                print("skipping get_corr_cnn_filters width=%d batch=%d (%.1f GB of activations)" % (
+                    width, batch_size, activation_bytes / 2 ** 30))
+                continue
+
+            list_one, list_two = synthetic_activations(batch_size, width, spatial_size, rng)
+            # the activations are passed as arguments, so that nothing keeps them alive once they are deleted
+            record("get_corr_cnn_filters", width, batch_size, get_corr_cnn_filters, list_one, list_two)
+            list_cross_corr = get_corr_cnn_filters(list_one, list_two)
+            del list_one, list_two
+
+        if list_cross_corr is None:
+            continue
+
+        list_self_corr = [synthetic_self_correlation(width, rng) for _ in range(num_layers)]
+        permutations = [rng.permutation(width) for _ in range(num_layers)]
+        num_transplants = width // 4
+        indices_transplant = [rng.choice(width, num_transplants, replace=False) for _ in range(num_layers)]
+        indices_remove = [rng.choice(width, num_transplants, replace=False) for _ in range(num_layers)]
+
+        record("bipartite_matching", width, None, lambda: bipartite_matching(list_cross_corr[0], "safe_crossover"))
+        for engine in MATCHING_ENGINES:
+            if engine != "dense":
+                record("bipartite_matching_" + engine, width, None,
+                       lambda: bipartite_matching(list_cross_corr[0], "safe_crossover", engine))
+        record("crossover_method", width, None,
+               lambda: crossover_method(weights_one, weights_two, list_cross_corr, "safe_crossover", plan))
+        record("weight_matching", width, None, lambda: weight_matching(weights_one, weights_two, plan, seed=0))
+        record("permute_cnn", width, None, lambda: permute_cnn(list(weights_one), permutations, plan))
+        record("transplant_neurons", width, None,
+               lambda: [transplant_neurons(list(weights_one), weights_two, indices_transplant, indices_remove, layer,
+                                           plan) for layer in range(num_layers)])
+        record("transplant_all_neurons", width, None,
+               lambda: transplant_all_neurons(list(weights_one), list(weights_two), indices_transplant, indices_remove,
+                                              indices_remove, indices_transplant, num_layers, plan))
+        record("identify_interesting_neurons", width, None,
+               lambda: identify_interesting_neurons(list_cross_corr, list_self_corr, list_self_corr))
+        record("arithmetic_crossover", width, None, lambda: arithmetic_crossover(weights_one, weights_two))
+
+    return records
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(path_old, path_new):
+    with open(path_old) as file_old, open(path_new) as file_new:
+        records_old = json.load(file_old)["records"]
+        records_new = json.load(file_new)["records"]
+
+    old = {(record["function"], record["width"], record["batch_size"]): record for record in records_old}
+    for record in records_new:
+        key = (record["function"], record["width"], record["batch_size"])
+        if key in old:
+            print("%-30s width=%-5d batch=%-6s time x%.2f peak x%.2f" % (
+                key[0], key[1], key[2], record["median_s"] / max(old[key]["median_s"], 1e-12),
+                record["peak_bytes"] / max(old[key]["peak_bytes"], 1)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--widths", type=int, nargs="+", default=[64, 128, 256, 512, 1024])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[512, 5000, 50000])
+    parser.add_argument("--spatial-size", type=int, default=4)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--max-activation-gb", type=float, default=2.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        sys.exit(0)
+
+    records = run(args.widths, args.batch_sizes, args.spatial_size, args.repeats, args.max_activation_gb * 2 ** 30,
+                  args.seed)
+
+    metadata = {"git_revision": git_revision(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                "cpu_count": os.cpu_count(), "arguments": vars(args)}
+    with open(args.output, "w") as output_file:
+        json.dump({"metadata": metadata, "records": records}, output_file, indent=1)
@@ -0,0 +1,139 @@
+import collections
+import json
+import os
+import queue
+import random
+import threading
+
+import numpy as np
+
+from results_store import write_atomic
+
+
+def get_rng_state():
+    # state of the python and numpy global generators (match_random_filters, compute_neurons_variance, ...)
+    version, internal_state, gauss_next = random.getstate()
+    name, keys, position, has_gauss, cached_gaussian = np.random.get_state()
+
+    return {"python": [version, list(internal_state), gauss_next],
+            "numpy": [name, position, has_gauss, cached_gaussian]}, keys
+
+
+def set_rng_state(state, numpy_keys):
+    version, internal_state, gauss_next = state["python"]
+    random.setstate((version, tuple(internal_state), gauss_next))
+
+    name, position, has_gauss, cached_gaussian = state["numpy"]
+    np.random.set_state((name, numpy_keys, position, has_gauss, cached_gaussian))
+
+
+class LoopCheckpoints:
+    """Last completed iteration of long running loops, one .npz file per loop keyed by weight_cache.config_key.
+
+    A checkpoint holds named weight lists, a JSON history (loss curves, ...), the index of the next iteration and the
+    state of the python and numpy generators, written atomically after every iteration; load restores the generators
+    so a restarted loop continues with the same random draws. The checkpoint of a finished loop is removed.
+    """
+
+    def __init__(self, directory="checkpoints"):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        # returns (iteration, weights, history) or None when the loop has no checkpoint yet
+        try:
+            with np.load(self._path(key), allow_pickle=False) as archive:
+                state = json.loads(str(archive["state"]))
+                weights = {name: [archive[name + "_" + str(index)] for index in range(num_tensors)] for
+                           name, num_tensors in state["weights"].items()}
+                numpy_keys = archive["numpy_keys"]
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        set_rng_state(state["rng"], numpy_keys)
+
+        return state["iteration"], weights, state["history"]
+
+    def store(self, key, iteration, weights, history):
+        rng_state, numpy_keys = get_rng_state()
+        state = {"iteration": iteration, "history": history, "rng": rng_state,
+                 "weights": {name: len(weights_list) for name, weights_list in weights.items()}}
+
+        arrays = {name + "_" + str(index): tensor for name, weights_list in weights.items() for index, tensor in
+                  enumerate(weights_list)}
+
+        write_atomic(self._path(key), np.savez, numpy_keys=numpy_keys, state=json.dumps(state), **arrays)
+
+    def remove(self, key):
+        # called once the loop has finished, so that a new run with the same configuration starts from scratch
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+class AsyncCheckpointWriter:
+    """Writes weight snapshots to .npz files from a background thread.
+
+    submit only queues a host copy of the weights, so training does not wait on the disk; once max_pending snapshots
+    are waiting, submit blocks until the writer catches up. Files are written atomically (temp file and rename), and
+    with keep_last only the newest keep_last checkpoints of every group are kept on disk. Pruning only knows the files
+    written by this writer: checkpoints left in the directory by an earlier run are never removed.
+    """
+
+    def __init__(self, directory="parents_trained", max_pending=2, keep_last=None):
+        self.directory = directory
+        self.keep_last = keep_last
+        self.written = collections.defaultdict(collections.deque)
+        self.error = None
+        os.makedirs(directory, exist_ok=True)
+
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+
+                name, weights, group = item
+                path = os.path.join(self.directory, name + ".npz")
+                write_atomic(path, np.savez, *weights)
+
+                written = self.written[group]
+                if path not in written:
+                    written.append(path)
+                while self.keep_last is not None and len(written) > self.keep_last:
+                    try:
+                        os.remove(written.popleft())
+                    except FileNotFoundError:
+                        pass
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def submit(self, name, weights, group=None):
+        # weights is a list of numpy arrays that is not modified afterwards, like the result of model.get_weights()
+        self._raise_error()
+        self.queue.put((name, weights, group))
+
+    def flush(self):
+        self.queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,122 @@
+import numpy as np
+
+
+def sample_positions(hidden_layer, positions):
+    # flatten an activation batch to a (samples, neurons) matrix
+    if hidden_layer.ndim == 2 or positions is None:
+        return hidden_layer.reshape(-1, hidden_layer.shape[-1])
+
+    i_dim, j_dim = positions
+    images = np.arange(hidden_layer.shape[0])[:, None]
+
+    return hidden_layer[images, i_dim, j_dim, :].reshape(-1, hidden_layer.shape[-1])
+
+
+def draw_positions(hidden_layer, num_positions, rng):
+    # num_positions random spatial positions per image of a convolutional batch, None (every position) for dense
+    # layers or when num_positions is None
+    if hidden_layer.ndim == 2 or num_positions is None:
+        return None
+
+    batch_size, height, width = hidden_layer.shape[:3]
+    i_dim = rng.integers(0, height, (batch_size, num_positions))
+    j_dim = rng.integers(0, width, (batch_size, num_positions))
+
+    return i_dim, j_dim
+
+
+class CorrelationAccumulator:
+    """Running first and second moments of the neurons of two networks, layer by layer.
+
+    Activation batches are folded in as they come out of the models, so the full set of activation maps never has
+    to be held in memory. num_positions is the number of spatial positions drawn per image in the convolutional
+    layers (the same positions for both networks), or None to use every position. The batches may be float16 or
+    bfloat16; they are converted to float64 chunk_size samples at a time, so the float64 copies stay small.
+    """
+
+    def __init__(self, num_positions=1, seed=None, chunk_size=16384):
+        self.num_positions = num_positions
+        self.chunk_size = chunk_size
+        self.rng = np.random.default_rng(seed)
+        self.num_samples = None
+        self.shift_one = None
+        self.shift_two = None
+        self.sum_one = None
+        self.sum_two = None
+        self.sum_one_one = None
+        self.sum_two_two = None
+        self.sum_one_two = None
+
+    def _initialize(self, num_layers):
+        self.num_samples = [0] * num_layers
+        self.shift_one = [None] * num_layers
+        self.shift_two = [None] * num_layers
+        self.sum_one = [None] * num_layers
+        self.sum_two = [None] * num_layers
+        self.sum_one_one = [None] * num_layers
+        self.sum_two_two = [None] * num_layers
+        self.sum_one_two = [None] * num_layers
+
+    def update(self, hidden_layers_one, hidden_layers_two):
+        if self.num_samples is None:
+            self._initialize(len(hidden_layers_one))
+
+        for layer_id in range(len(hidden_layers_one)):
+            positions = draw_positions(hidden_layers_one[layer_id], self.num_positions, self.rng)
+            samples_one = sample_positions(hidden_layers_one[layer_id], positions)
+            samples_two = sample_positions(hidden_layers_two[layer_id], positions)
+
+            for start in range(0, samples_one.shape[0], self.chunk_size):
+                self._update_layer(layer_id, samples_one[start:start + self.chunk_size].astype(np.float64),
+                                   samples_two[start:start + self.chunk_size].astype(np.float64))
+
+    def _update_layer(self, layer_id, layer_one, layer_two):
+        # the moments are taken around the mean of the first chunk to limit cancellation
+        if self.shift_one[layer_id] is None:
+            self.shift_one[layer_id] = layer_one.mean(axis=0)
+            self.shift_two[layer_id] = layer_two.mean(axis=0)
+            self.sum_one[layer_id] = np.zeros(layer_one.shape[1])
+            self.sum_two[layer_id] = np.zeros(layer_two.shape[1])
+            self.sum_one_one[layer_id] = np.zeros((layer_one.shape[1], layer_one.shape[1]))
+            self.sum_two_two[layer_id] = np.zeros((layer_two.shape[1], layer_two.shape[1]))
+            self.sum_one_two[layer_id] = np.zeros((layer_one.shape[1], layer_two.shape[1]))
+
+        layer_one -= self.shift_one[layer_id]
+        layer_two -= self.shift_two[layer_id]
+
+        self.num_samples[layer_id] += layer_one.shape[0]
+        self.sum_one[layer_id] += layer_one.sum(axis=0)
+        self.sum_two[layer_id] += layer_two.sum(axis=0)
+        self.sum_one_one[layer_id] += layer_one.T @ layer_one
+        self.sum_two_two[layer_id] += layer_two.T @ layer_two
+        self.sum_one_two[layer_id] += layer_one.T @ layer_two
+
+    @staticmethod
+    def _correlation(num_samples, sum_x, sum_y, sum_xy, sum_xx_diag, sum_yy_diag):
+        mean_x = sum_x / num_samples
+        mean_y = sum_y / num_samples
+        covariance = sum_xy / num_samples - np.outer(mean_x, mean_y)
+        std_x = np.sqrt(np.maximum(sum_xx_diag / num_samples - mean_x ** 2, 0))
+        std_y = np.sqrt(np.maximum(sum_yy_diag / num_samples - mean_y ** 2, 0))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr_matrix = covariance / np.outer(std_x, std_y)
+        corr_matrix[~np.isfinite(corr_matrix)] = 0
+
+        return corr_matrix
+
+    def cross_correlation(self):
+        # entry [i, j] is the correlation between neuron i of network one and neuron j of network two
+        return [self._correlation(self.num_samples[index], self.sum_one[index], self.sum_two[index],
+                                  self.sum_one_two[index], np.diag(self.sum_one_one[index]),
+                                  np.diag(self.sum_two_two[index])) for index in range(len(self.num_samples))]
+
+    def self_correlation_one(self):
+        return [self._correlation(self.num_samples[index], self.sum_one[index], self.sum_one[index],
+                                  self.sum_one_one[index], np.diag(self.sum_one_one[index]),
+                                  np.diag(self.sum_one_one[index])) for index in range(len(self.num_samples))]
+
+    def self_correlation_two(self):
+        return [self._correlation(self.num_samples[index], self.sum_two[index], self.sum_two[index],
+                                  self.sum_two_two[index], np.diag(self.sum_two_two[index]),
+                                  np.diag(self.sum_two_two[index])) for index in range(len(self.num_samples))]
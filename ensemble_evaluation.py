@@ -0,0 +1,47 @@
+import numpy as np
+import keras
+
+
+class EnsembleEvaluator:
+    """num_members copies of an architecture behind one shared input.
+
+    evaluate scores up to num_members weight sets in one pass over the data: every batch is read once and goes
+    through a single graph that holds all the members.
+    """
+
+    def __init__(self, architecture, data, num_members):
+        self.members = [architecture(0, data) for _ in range(num_members)]
+
+        inputs = keras.layers.Input(shape=keras.backend.int_shape(self.members[0].input)[1:])
+        outputs = [member(inputs) for member in self.members]
+        self.model = keras.models.Model(inputs=inputs, outputs=outputs)
+
+    def evaluate(self, list_weights, dataset):
+        # returns one (loss, accuracy) pair per weight set, the loss includes the regularization terms like evaluate
+        num_candidates = len(list_weights)
+        for member, weights in zip(self.members, list_weights):
+            member.set_weights(weights)
+
+        sum_loss = np.zeros(num_candidates)
+        num_correct = np.zeros(num_candidates)
+        num_samples = 0
+
+        for batch_x, batch_y in dataset:
+            predictions = self.model.predict_on_batch(batch_x)
+            if not isinstance(predictions, list):
+                predictions = [predictions]
+
+            labels = np.asarray(batch_y).reshape(-1).astype(int)
+            rows = np.arange(labels.shape[0])
+            for index in range(num_candidates):
+                probabilities = np.asarray(predictions[index])
+                label_probabilities = np.clip(probabilities[rows, labels], keras.backend.epsilon(), 1)
+                sum_loss[index] -= np.sum(np.log(label_probabilities))
+                num_correct[index] += np.count_nonzero(np.argmax(probabilities, axis=1) == labels)
+            num_samples += labels.shape[0]
+
+        regularization = [sum(float(keras.backend.eval(loss)) for loss in member.losses) for member in
+                          self.members[:num_candidates]]
+
+        return [(sum_loss[index] / num_samples + regularization[index], num_correct[index] / num_samples) for index in
+                range(num_candidates)]
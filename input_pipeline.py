@@ -0,0 +1,57 @@
+import numpy as np
+import tensorflow as tf
+
+from load_data import normalize_images
+
+
+def make_dataset(x, y=None, batch_size=128, seed=None, cache=False):
+    """Batched and prefetched tf.data pipeline over an in-memory or memory-mapped image store.
+
+    Only sample indices go through tf.data; every batch is gathered from x and converted to float32 on the fly, so
+    the training set is never duplicated. uint8 images are normalized to [0, 1], float images (already normalized by
+    load_cifar and co.) are only cast. With a seed, the samples are reshuffled every epoch in an order that only
+    depends on that seed (the work_id). cache keeps the batches in memory after the first epoch, so it can only be
+    used without a seed (a cached pipeline would replay the order of its first epoch).
+    """
+
+    if cache and seed is not None:
+        raise ValueError('a cached pipeline cannot be reshuffled every epoch')
+
+    if x.dtype == np.uint8:
+        convert_images = normalize_images
+    else:
+        def convert_images(x_batch):
+            return np.asarray(x_batch, dtype=np.float32)
+
+    num_samples = x.shape[0]
+    dataset = tf.data.Dataset.range(num_samples)
+    if seed is not None:
+        dataset = dataset.shuffle(num_samples, seed=seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(batch_size)
+
+    def load_batch(indices):
+        # sorted indices keep the reads from a memory map sequential
+        indices = np.sort(indices)
+        if y is None:
+            return convert_images(x[indices])
+
+        return convert_images(x[indices]), np.asarray(y[indices])
+
+    def load_batch_tensors(indices):
+        if y is None:
+            batch_x = tf.numpy_function(load_batch, [indices], tf.float32)
+            batch_x.set_shape((None,) + tuple(x.shape[1:]))
+
+            return batch_x
+
+        batch_x, batch_y = tf.numpy_function(load_batch, [indices], [tf.float32, tf.as_dtype(y.dtype)])
+        batch_x.set_shape((None,) + tuple(x.shape[1:]))
+        batch_y.set_shape((None,) + tuple(y.shape[1:]))
+
+        return batch_x, batch_y
+
+    dataset = dataset.map(load_batch_tensors, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    if cache:
+        dataset = dataset.cache()
+
+    return dataset.prefetch(tf.data.experimental.AUTOTUNE)
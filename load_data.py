@@ -1,30 +1,55 @@
+import os
+
+import numpy as np
 import keras
 
+from results_store import write_atomic
 
-def load_mnist():
-    (x_train, y_train), (x_test, y_test) = keras.datasets.mnist.load_data()
-    x_train, x_test = x_train / 255.0, x_test / 255.0
 
-    return x_train, x_test, y_train, y_test
+DATASETS = {"mnist": keras.datasets.mnist, "cifar10": keras.datasets.cifar10, "cifar100": keras.datasets.cifar100}
 
 
-def load_cifar_100(label_mode="fine"):
-    (x_train, y_train), (x_test, y_test) = keras.datasets.cifar100.load_data(label_mode)
-    x_train = x_train.astype('float32')
-    x_test = x_test.astype('float32')
+def load_dataset_store(data, directory="datasets", label_mode="fine"):
+    # the raw uint8 arrays are written once as .npy files, then every process memory-maps them read-only
+    name = data if data != "cifar100" or label_mode == "fine" else data + "_" + label_mode
+    paths = [os.path.join(directory, name + "_" + array_name + ".npy") for array_name in
+             ["x_train", "x_test", "y_train", "y_test"]]
+
+    if not all(os.path.exists(path) for path in paths):
+        if data == "cifar100":
+            (x_train, y_train), (x_test, y_test) = DATASETS[data].load_data(label_mode)
+        else:
+            (x_train, y_train), (x_test, y_test) = DATASETS[data].load_data()
 
-    x_train = x_train / 255.0
-    x_test = x_test / 255.0
+        os.makedirs(directory, exist_ok=True)
+        for path, array in zip(paths, [x_train, x_test, y_train, y_test]):
+            write_atomic(path, np.save, array)
+
+    x_train, x_test, y_train, y_test = [np.load(path, mmap_mode="r") for path in paths]
 
     return x_train, x_test, y_train, y_test
 
 
-def load_cifar():
-    (x_train, y_train), (x_test, y_test) = keras.datasets.cifar10.load_data()
-    x_train = x_train.astype('float32')
-    x_test = x_test.astype('float32')
+def normalize_images(x_batch):
+    x_batch = np.array(x_batch, dtype=np.float32)
+    x_batch /= 255.0
+
+    return x_batch
+
 
-    x_train = x_train / 255.0
-    x_test = x_test / 255.0
+def load_mnist():
+    x_train, x_test, y_train, y_test = load_dataset_store("mnist")
+
+    return normalize_images(x_train), normalize_images(x_test), y_train, y_test
+
+
+def load_cifar_100(label_mode="fine"):
+    x_train, x_test, y_train, y_test = load_dataset_store("cifar100", label_mode=label_mode)
+
+    return normalize_images(x_train), normalize_images(x_test), y_train, y_test
+
+
+def load_cifar():
+    x_train, x_test, y_train, y_test = load_dataset_store("cifar10")
 
-    return x_train, x_test, y_train, y_test
\ No newline at end of file
+    return normalize_images(x_train), normalize_images(x_test), y_train, y_test
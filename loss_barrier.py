@@ -0,0 +1,107 @@
+import weakref
+
+import numpy as np
+import keras
+
+from input_pipeline import make_dataset
+from weight_vector import WeightVector
+
+
+# per model: one extractor per BatchNormalization layer returning the input of that layer
+_batchnorm_extractor_cache = weakref.WeakKeyDictionary()
+
+
+def get_batchnorm_extractors(model):
+    if model not in _batchnorm_extractor_cache:
+        batchnorm_layers = [layer for layer in model.layers if isinstance(layer, keras.layers.BatchNormalization)]
+        _batchnorm_extractor_cache[model] = [(layer, keras.models.Model(inputs=model.layers[0].input, outputs=layer.input))
+                                             for layer in batchnorm_layers]
+
+    return _batchnorm_extractor_cache[model]
+
+
+def recalibrate_batchnorm(model, calibration_data, batch_size=512):
+    # re-estimate the moving statistics of the BatchNormalization layers on calibration_data, one layer after the
+    # other so that every layer sees the inputs produced by the already recalibrated layers before it
+    if isinstance(calibration_data, np.ndarray):
+        calibration_data = make_dataset(calibration_data, batch_size=batch_size)
+
+    for layer, extractor in get_batchnorm_extractors(model):
+        num_samples = 0
+        sum_inputs = 0
+        sum_squared_inputs = 0
+
+        for batch_x in calibration_data:
+            inputs = np.asarray(extractor.predict_on_batch(batch_x), dtype=np.float64)
+            inputs = inputs.reshape(-1, inputs.shape[-1])
+
+            num_samples += inputs.shape[0]
+            sum_inputs = sum_inputs + inputs.sum(axis=0)
+            sum_squared_inputs = sum_squared_inputs + np.square(inputs).sum(axis=0)
+
+        mean = sum_inputs / num_samples
+        variance = np.maximum(sum_squared_inputs / num_samples - mean ** 2, 0)
+        keras.backend.batch_set_value([(layer.moving_mean, mean), (layer.moving_variance, variance)])
+
+
+def barrier_heights(t_sorted, loss):
+    # height of the loss above the straight line between the two ends of the path
+    t_sorted = np.asarray(t_sorted)
+    loss = np.asarray(loss)
+    line = loss[0] + (loss[-1] - loss[0]) * (t_sorted - t_sorted[0]) / max(t_sorted[-1] - t_sorted[0], 1e-12)
+
+    return loss - line
+
+
+def interpolation_sweep(model, weights_one, weights_two, dataset, t_values=None, num_points=11, num_refinements=0,
+                        calibration_data=None):
+    """Loss and accuracy along the linear path t * weights_one + (1 - t) * weights_two.
+
+    weights_one and weights_two are two aligned weight sets (as returned by crossover_method). model is a compiled
+    model of the same architecture, reused for every t; the interpolated weights are written in place into one scratch
+    buffer. The t values are t_values, or a grid of num_points values in [0, 1]; each refinement round then evaluates
+    the midpoints around the t with the highest loss barrier. With calibration_data (a small subset of the training
+    images) the BatchNormalization statistics are re-estimated for every t.
+    """
+
+    vector_one = WeightVector.from_weights(weights_one)
+    vector_two = WeightVector.from_weights(weights_two)
+    vector_t = vector_one.copy()
+    if isinstance(calibration_data, np.ndarray):
+        calibration_data = make_dataset(calibration_data, batch_size=512)
+
+    results = {}
+
+    def evaluate_t(t):
+        np.copyto(vector_t.buffer, vector_one.buffer)
+        vector_t.blend(vector_two, t)
+        model.set_weights(vector_t.tensors)
+
+        if calibration_data is not None:
+            recalibrate_batchnorm(model, calibration_data)
+
+        scores = model.evaluate(dataset, verbose=0)
+        results[t] = (scores[0], scores[1])
+
+    if t_values is None:
+        t_values = np.linspace(0, 1, num_points)
+    for t in t_values:
+        evaluate_t(float(t))
+
+    for _ in range(num_refinements):
+        t_sorted = sorted(results)
+        barrier = barrier_heights(t_sorted, [results[t][0] for t in t_sorted])
+        index = int(np.argmax(barrier))
+
+        for neighbour in [index - 1, index + 1]:
+            if 0 <= neighbour < len(t_sorted):
+                t = (t_sorted[index] + t_sorted[neighbour]) / 2
+                if t not in results:
+                    evaluate_t(t)
+
+    t_sorted = sorted(results)
+    loss = np.array([results[t][0] for t in t_sorted])
+    accuracy = np.array([results[t][1] for t in t_sorted])
+
+    return {"t": np.array(t_sorted), "loss": loss, "accuracy": accuracy,
+            "barrier": float(np.max(barrier_heights(t_sorted, loss)))}
@@ -1,203 +1,395 @@
 import numpy as np
+import random
 from timeit import default_timer as timer
 import warnings
-import pickle
-import copy
 
 import tensorflow as tf
 print("Num GPUs Available: ", len(tf.config.list_physical_devices('GPU')))
-import keras
 
-from load_data import load_cifar
-from load_data import load_mnist
-from load_data import load_cifar_100
+from load_data import load_dataset_store
+
+from input_pipeline import make_dataset
 
 from utils import identify_interesting_neurons
-from utils import transplant_neurons
-from utils import get_hidden_layers
+from utils import transplant_all_neurons
 from utils import match_random_filters
-from utils import get_corr_cnn_filters
+from utils import random_filter_candidates
+from utils import transplant_candidates
+from utils import get_corr_matrices
 from utils import crossover_method
 from utils import arithmetic_crossover
 
 from neural_models import keras_model_cnn
+
+from checkpoint import LoopCheckpoints
+from model_pool import ModelPool
+from parallel import run_parallel
+from profiling import phase
+from profiling import profiler
+from results_store import ResultsWriter
+from permutation_plan import get_permutation_plan
+from weight_matching import weight_matching_crossover
+from weight_cache import WeightCache
+from weight_cache import config_key
+from weight_cache import fit_cached
+from training_scheduler import early_stopping
+from training_scheduler import fit_early_stopping
+from training_scheduler import successive_halving
 warnings.filterwarnings("ignore")
 
 
+# trained parents are shared between runs, crossover methods and worker processes
+weight_cache = WeightCache("parents_cache")
+# built and compiled models are reused for the whole life of the process
+model_pool = ModelPool()
+# state of the transplant loops after every iteration, to resume interrupted runs
+loop_checkpoints = LoopCheckpoints("checkpoints")
+# the only output of the runs: every process appends its own shards, read them back with
+# results_store.read_results("results")
+results_writer = ResultsWriter("results")
+
+
+def training_config(model, architecture, seed, data, shuffle_seed, epochs, batch_size, patience=None, **extra):
+    config = {"architecture": architecture.__name__, "seed": seed, "data": data, "shuffle_seed": shuffle_seed,
+              "epochs": epochs, "batch_size": batch_size, "optimizer": model.optimizer.get_config()}
+    # early stopping changes the trained weights, runs without it keep their previous keys
+    if patience is not None:
+        config["patience"] = patience
+    config.update(extra)
+
+    return config
+
+
+def stopping_callbacks(patience):
+    if patience is None:
+        return []
+
+    return [early_stopping(patience)]
+
+
+def select_random_filters(weights_one, weights_two, q_values_list, list_cross_corr, num_candidates, num_layers, plan, data,
+                          selection_data, rng, train_data=None, selection_epochs=0, test_data=None):
+    # draw num_candidates random transplants in each direction and return the indices of the best offspring one and
+    # offspring two: scored untrained in one pass over selection_data, or after a successive halving race of up to
+    # selection_epochs epochs. The race also returns both winners as (trained weights, curve), where the curve holds
+    # their test_data loss right after the transplant and after every race epoch (None when scored untrained)
+    list_transplant_one, list_remove_one = random_filter_candidates(q_values_list[:num_layers], list_cross_corr[:num_layers],
+                                                                    num_candidates, rng)
+    list_transplant_two, list_remove_two = random_filter_candidates(q_values_list[:num_layers], list_cross_corr[:num_layers],
+                                                                    num_candidates, rng)
+
+    _, candidates_one = transplant_candidates(weights_one, weights_two, list_transplant_one, list_remove_one, plan)
+    _, candidates_two = transplant_candidates(weights_two, weights_one, list_transplant_two, list_remove_two, plan)
+
+    trained_offspring = None
+    if selection_epochs > 0:
+        best = []
+        winners = []
+        for candidates in [candidates_one, candidates_two]:
+            models = [model_pool.acquire(keras_model_cnn, data, offspring.tensors) for offspring in candidates]
+            ranking, histories = successive_halving(models, train_data, selection_data, selection_epochs,
+                                                    test_data=test_data, verbose=0)
+            winners.append((candidates[ranking[0]].tensors, models[ranking[0]].get_weights(),
+                            histories[ranking[0]]["test_loss"]))
+            model_pool.release(*models)
+            best.append(ranking[0])
+        best_one, best_two = best
+
+        # the untrained transplants of both winners are scored in one pass, as the first point of their curves
+        evaluator = model_pool.ensemble(keras_model_cnn, data, 2)
+        list_scores = evaluator.evaluate([untrained for untrained, _, _ in winners], test_data)
+        trained_offspring = [(weights, [float(loss)] + curve) for (_, weights, curve), (loss, _) in
+                             zip(winners, list_scores)]
+
+    else:
+        evaluator = model_pool.ensemble(keras_model_cnn, data, 2 * num_candidates)
+        list_scores = evaluator.evaluate([offspring.tensors for offspring in candidates_one + candidates_two], selection_data)
+        losses = np.array([loss for loss, _ in list_scores])
+
+        best_one = int(np.argmin(losses[:num_candidates]))
+        best_two = int(np.argmin(losses[num_candidates:]))
+        print("best candidate losses: ", losses[best_one], losses[num_candidates + best_two])
+
+    return ([indices[best_one] for indices in list_transplant_one], [indices[best_one] for indices in list_remove_one],
+            [indices[best_two] for indices in list_transplant_two], [indices[best_two] for indices in list_remove_two],
+            trained_offspring)
+
+
 def transplant_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, num_trainable_layer=5, batch_size_activation=512,
-                         batch_size_sgd=128, work_id=0):
+                         batch_size_sgd=128, work_id=0, num_candidates=1, num_selection_samples=2048, selection_epochs=0,
+                         patience=None, probe_samples=None, num_probe_positions=4):
+
+    # the candidate offspring of targeted_crossover_random are ranked on a slice held out of the training set
+    selection_data = None
+    held_out = {}
+    if crossover == "targeted_crossover_random" and num_candidates > 1:
+        selection_data = make_dataset(x_train[-num_selection_samples:], y_train[-num_selection_samples:],
+                                      batch_size_activation, cache=True)
+        x_train, y_train = x_train[:-num_selection_samples], y_train[:-num_selection_samples]
+        # the parents trained without those samples get their own weight cache keys
+        held_out = {"held_out_samples": num_selection_samples}
+
+    # the uint8 images are normalized one batch at a time, the training set is reshuffled every epoch
+    train_data = make_dataset(x_train, y_train, batch_size_sgd, seed=work_id + 1)
+    test_data = make_dataset(x_test, y_test, batch_size_sgd)
+    # with probe_samples, the offspring are aligned on the first probe_samples test images only
+    activation_data = make_dataset(x_test[:probe_samples], batch_size=batch_size_activation)
+    num_positions = 1 if probe_samples is None else num_probe_positions
+
+    # the winners of a successive halving race continue their training, they only get the rest of the 50 epochs
+    initial_epoch = selection_epochs if selection_data is not None else 0
 
-    result_list = []
     print("crossover method: " + crossover)
-    for safety_level in ["safe_crossover", "naive_crossover"]:
+    safety_levels = ["safe_crossover", "naive_crossover"]
+    run_keys = []
+    for safety_level in safety_levels:
         print(safety_level)
 
+        # the loop restarts from its last completed iteration when a run with the same configuration is resumed
+        run_key = config_key({"function": "transplant_crossover", "crossover": crossover, "safety_level": safety_level,
+                              "data": data, "work_id": work_id, "num_transplants": num_transplants,
+                              "num_trainable_layer": num_trainable_layer, "batch_size_activation": batch_size_activation,
+                              "batch_size_sgd": batch_size_sgd, "num_candidates": num_candidates,
+                              "selection_epochs": selection_epochs, "patience": patience, "probe_samples": probe_samples,
+                              "num_probe_positions": num_probe_positions})
+        run_keys.append(run_key)
+        start_epoch = 0
         loss_list = []
-        for epoch in range(num_transplants + 1):
+        # curves of the race winners of the previous iteration, continued by their training in the next one
+        race_curves = None
+
+        checkpoint = loop_checkpoints.load(run_key)
+        if checkpoint is not None:
+            start_epoch, checkpoint_weights, history = checkpoint
+            loss_list, race_curves = history["loss_list"], history["race_curves"]
+            weights_offspring_one = checkpoint_weights["offspring_one"]
+            weights_offspring_two = checkpoint_weights["offspring_two"]
+            print("resuming from transplant number: " + str(start_epoch))
+
+        # the checkpoints of the completed safety levels stay until the whole run has finished
+        if start_epoch > num_transplants:
+            print("already completed")
+            continue
+
+        for epoch in range(start_epoch, num_transplants + 1):
             print("Transplant number: " + str(epoch))
 
-            # reset upper layers to random initialization
-            model_offspring_one = keras_model_cnn(work_id, data)
-            model_offspring_two = keras_model_cnn(work_id + 1000, data)
-
             if epoch > 0:
                 # get the randomly reset weights
-                model_offspring_one.set_weights(weights_offspring_one)
-                model_offspring_two.set_weights(weights_offspring_two)
-
-                loss_after_transplant_one = model_offspring_one.evaluate(x_test, y_test)[0]
-                loss_after_transplant_two = model_offspring_two.evaluate(x_test, y_test)[0]
-
-            model_information_offspring_one = model_offspring_one.fit(x_train, y_train, batch_size=batch_size_sgd, epochs=50,
-                                                                      verbose=2, validation_data=(x_test, y_test))
-
-            model_information_offspring_two = model_offspring_two.fit(x_train, y_train, batch_size=batch_size_sgd, epochs=50,
-                                                                      verbose=2, validation_data=(x_test, y_test))
+                model_offspring_one = model_pool.acquire(keras_model_cnn, data, weights_offspring_one)
+                model_offspring_two = model_pool.acquire(keras_model_cnn, data, weights_offspring_two)
+
+                if race_curves is None:
+                    with phase("evaluation"):
+                        curve_one = [model_offspring_one.evaluate(test_data)[0]]
+                        curve_two = [model_offspring_two.evaluate(test_data)[0]]
+                else:
+                    # the race winners were scored right after the transplant and after each of their race epochs
+                    curve_one, curve_two = race_curves
+
+                # with a patience, the val_loss curves stop at the epoch where the offspring converged
+                with phase("offspring_training"):
+                    history_offspring_one = fit_early_stopping(model_offspring_one, train_data, test_data, 50, patience,
+                                                               verbose=2, initial_epoch=initial_epoch)
+                    history_offspring_two = fit_early_stopping(model_offspring_two, train_data, test_data, 50, patience,
+                                                               verbose=2, initial_epoch=initial_epoch)
 
-            loss_one = model_information_offspring_one.history["val_loss"]
-            loss_two = model_information_offspring_two.history["val_loss"]
+            else:
+                # the first offspring only depend on their seeds and the data, every safety level reuses them
+                model_offspring_one = model_pool.acquire(keras_model_cnn, data, seed=work_id)
+                model_offspring_two = model_pool.acquire(keras_model_cnn, data, seed=work_id + 1000)
+
+                config_one = training_config(model_offspring_one, keras_model_cnn, work_id, data, work_id + 1, 50, batch_size_sgd,
+                                             patience, **held_out)
+                config_two = training_config(model_offspring_two, keras_model_cnn, work_id + 1000, data, work_id + 1, 50,
+                                             batch_size_sgd, patience, **held_out)
+
+                with phase("parent_training"):
+                    history_offspring_one = fit_cached(weight_cache, model_offspring_one, config_one, train_data,
+                                                       epochs=50, verbose=2, validation_data=test_data,
+                                                       callbacks=stopping_callbacks(patience))
+                    history_offspring_two = fit_cached(weight_cache, model_offspring_two, config_two, train_data,
+                                                       epochs=50, verbose=2, validation_data=test_data,
+                                                       callbacks=stopping_callbacks(patience))
+
+            loss_one = history_offspring_one["val_loss"]
+            loss_two = history_offspring_two["val_loss"]
 
             if epoch > 0:
-                loss_one.insert(0, loss_after_transplant_one)
-                loss_two.insert(0, loss_after_transplant_two)
+                loss_one[:0] = curve_one
+                loss_two[:0] = curve_two
 
             loss_list.append(loss_one)
             loss_list.append(loss_two)
 
+            results_writer.append(work_id, crossover, safety_level, epoch, 0, loss_one, timings=profiler.seconds())
+            results_writer.append(work_id, crossover, safety_level, epoch, 1, loss_two, timings=profiler.seconds())
+
             weights_offspring_one = model_offspring_one.get_weights()
             weights_offspring_two = model_offspring_two.get_weights()
 
             # compute the cross correlation matrix
-            hidden_representation_offspring_one = get_hidden_layers(model_offspring_one, x_test, batch_size_activation)
-            hidden_representation_offspring_two = get_hidden_layers(model_offspring_two, x_test, batch_size_activation)
-
-            list_cross_corr = get_corr_cnn_filters(hidden_representation_offspring_one, hidden_representation_offspring_two)
-            self_corr_offspring_one = get_corr_cnn_filters(hidden_representation_offspring_one, hidden_representation_offspring_one)
-            self_corr_offspring_two = get_corr_cnn_filters(hidden_representation_offspring_two, hidden_representation_offspring_two)
+            list_cross_corr, self_corr_offspring_one, self_corr_offspring_two = get_corr_matrices(
+                model_offspring_one, model_offspring_two, activation_data, batch_size_activation, num_positions,
+                seed=work_id + epoch)
 
             # functionally align the networks
+            plan = get_permutation_plan(model_offspring_one)
+            model_pool.release(model_offspring_one, model_offspring_two)
             list_ordered_indices_one, list_ordered_indices_two, weights_offspring_one, weights_offspring_two = crossover_method(
-                weights_offspring_one, weights_offspring_two, list_cross_corr, safety_level)
+                weights_offspring_one, weights_offspring_two, list_cross_corr, safety_level, plan)
 
             # re-order the correlation matrices
             list_cross_corr = [list_cross_corr[index][:, list_ordered_indices_two[index]] for index in
                                range(len(list_ordered_indices_two))]
 
             q_values_list = [0.5] * len(list_cross_corr)
+            trained_offspring = None
+            race_curves = None
 
             if crossover == "targeted_crossover_low_corr":
-                # identify neurons to transplant from offspring two to offspring one
-                list_neurons_to_transplant_one, list_neurons_to_remove_one = identify_interesting_neurons(list_cross_corr,
-                                                                                                          self_corr_offspring_one,
-                                                                                                          self_corr_offspring_two)
-
-                # identify neurons to transplant from offspring one to offspring two
-                list_cross_corr_transpose = [np.transpose(corr_matrix) for corr_matrix in list_cross_corr]
-                list_neurons_to_transplant_two, list_neurons_to_remove_two = identify_interesting_neurons(list_cross_corr_transpose,
-                                                                                                          self_corr_offspring_two,
-                                                                                                          self_corr_offspring_one)
+                with phase("neuron_selection"):
+                    # identify neurons to transplant from offspring two to offspring one
+                    list_neurons_to_transplant_one, list_neurons_to_remove_one = identify_interesting_neurons(list_cross_corr,
+                                                                                                              self_corr_offspring_one,
+                                                                                                              self_corr_offspring_two)
+
+                    # identify neurons to transplant from offspring one to offspring two
+                    list_cross_corr_transpose = [np.transpose(corr_matrix) for corr_matrix in list_cross_corr]
+                    list_neurons_to_transplant_two, list_neurons_to_remove_two = identify_interesting_neurons(list_cross_corr_transpose,
+                                                                                                              self_corr_offspring_two,
+                                                                                                              self_corr_offspring_one)
+
+            elif crossover == "targeted_crossover_random" and num_candidates > 1:
+                # many random transplants per alignment, only the best one of each offspring is trained
+                rng = np.random.default_rng([work_id, epoch, safety_levels.index(safety_level)])
+                with phase("candidate_selection"):
+                    list_neurons_to_transplant_one, list_neurons_to_remove_one, list_neurons_to_transplant_two, list_neurons_to_remove_two, trained_offspring = select_random_filters(
+                        weights_offspring_one, weights_offspring_two, q_values_list, list_cross_corr, num_candidates,
+                        num_trainable_layer - 1, plan, data, selection_data, rng, train_data, selection_epochs, test_data)
 
             elif crossover == "targeted_crossover_random":
                 list_neurons_to_transplant_one, list_neurons_to_remove_one = match_random_filters(q_values_list, list_cross_corr)
                 list_neurons_to_transplant_two, list_neurons_to_remove_two = match_random_filters(q_values_list, list_cross_corr)
 
             if crossover == "arithmetic_crossover":
-                weights_offspring_one = arithmetic_crossover(weights_offspring_one, weights_offspring_two)
+                with phase("blending"):
+                    weights_offspring_one = arithmetic_crossover(weights_offspring_one, weights_offspring_two)
 
-                weights_offspring_one_copy = copy.deepcopy(weights_offspring_one)
-                weights_offspring_two = weights_offspring_one_copy
+                # set_weights copies the values, so both offspring can start from the same buffer
+                weights_offspring_two = weights_offspring_one
 
-            else:
+            elif trained_offspring is not None:
+                # the winners of the race already carry their transplant
+                (weights_offspring_one, curve_one), (weights_offspring_two, curve_two) = trained_offspring
+                race_curves = [curve_one, curve_two]
 
-                weights_offspring_one_tmp = copy.deepcopy(weights_offspring_one)
-                weights_offspring_two_tmp = copy.deepcopy(weights_offspring_two)
+            else:
 
-                depth = 0
-                for layer in range(num_trainable_layer - 1):
-                    # transplant offspring one
-                    weights_offspring_one = transplant_neurons(weights_offspring_one, weights_offspring_two_tmp, list_neurons_to_transplant_one,
-                                                               list_neurons_to_remove_one, layer, depth)
+                with phase("transplant"):
+                    # both offspring exchange their neurons in one pass, reading from the weights before the transplant
+                    weights_offspring_one, weights_offspring_two = transplant_all_neurons(
+                        weights_offspring_one, weights_offspring_two, list_neurons_to_transplant_one, list_neurons_to_remove_one,
+                        list_neurons_to_transplant_two, list_neurons_to_remove_two, num_trainable_layer - 1, plan)
 
-                    # transplant offspring two
-                    weights_offspring_two = transplant_neurons(weights_offspring_two, weights_offspring_one_tmp, list_neurons_to_transplant_two,
-                                                               list_neurons_to_remove_two, layer, depth)
+            with phase("checkpoint"):
+                loop_checkpoints.store(run_key, epoch + 1, {"offspring_one": weights_offspring_one,
+                                                            "offspring_two": weights_offspring_two},
+                                       {"loss_list": [[float(loss) for loss in losses] for losses in loss_list],
+                                        "race_curves": race_curves})
 
-                    depth = (layer + 1) * 6
+            # the records of an iteration are written once it is checkpointed, a resumed run cannot write them twice
+            results_writer.flush()
 
-        result_list.append(loss_list)
+    for run_key in run_keys:
+        loop_checkpoints.remove(run_key)
 
-        keras.backend.clear_session()
 
-    return result_list
+def average_weights_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, batch_size_activation=512,
+                         batch_size_sgd=128, work_id=0, alignment="activations", patience=None):
 
+    # the uint8 images are normalized one batch at a time, the training set is reshuffled every epoch
+    train_data = make_dataset(x_train, y_train, batch_size_sgd, seed=work_id + 1)
+    test_data = make_dataset(x_test, y_test, batch_size_sgd)
+    activation_data = make_dataset(x_test, batch_size=batch_size_activation)
 
-def average_weights_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, batch_size_activation=512,
-                         batch_size_sgd=128, work_id=0):
-    result_list = []
     print("crossover method: " + crossover)
 
     for epoch in range(num_transplants + 1):
         print("Transplant number: " + str(epoch))
 
         # reset upper layers to random initialization
-        model_parent = keras_model_cnn(work_id, data)
-        model_parent.fit(x_train, y_train, batch_size=batch_size_sgd, epochs=50,
-                                                                      verbose=2, validation_data=(x_test, y_test))
+        # the repetition index is part of the keys so that the repetitions of one run stay independent samples
+        model_parent = model_pool.acquire(keras_model_cnn, data, seed=work_id)
+        config_parent = training_config(model_parent, keras_model_cnn, work_id, data, work_id + 1, 50, batch_size_sgd,
+                                        patience, repetition=epoch)
+        with phase("parent_training"):
+            fit_cached(weight_cache, model_parent, config_parent, train_data, epochs=50, verbose=2, validation_data=test_data,
+                       callbacks=stopping_callbacks(patience))
 
         weights_parent = model_parent.get_weights()
+        model_pool.release(model_parent)
 
-        model_parent_one = keras_model_cnn(0, data)
-        model_parent_two = keras_model_cnn(0, data)
-        model_parent_one.set_weights(weights_parent)
-        model_parent_two.set_weights(weights_parent)
+        model_parent_one = model_pool.acquire(keras_model_cnn, data, weights_parent)
+        model_parent_two = model_pool.acquire(keras_model_cnn, data, weights_parent)
 
-        model_parent_one_info = model_parent_one.fit(x_train, y_train, batch_size=batch_size_sgd, epochs=10,
-                                        verbose=2, validation_data=(x_test, y_test))
-        model_parent_two_info = model_parent_two.fit(x_train, y_train, batch_size=batch_size_sgd, epochs=10,
-                                        verbose=2, validation_data=(x_test, y_test))
+        config_parent_one = training_config(model_parent_one, keras_model_cnn, 0, data, work_id + 1, 10, batch_size_sgd,
+                                            parent=config_key(config_parent), child=0)
+        config_parent_two = training_config(model_parent_two, keras_model_cnn, 0, data, work_id + 1, 10, batch_size_sgd,
+                                            parent=config_key(config_parent), child=1)
 
-        best_parent_loss = min(model_parent_one_info.history["val_loss"][-1], model_parent_two_info.history["val_loss"][-1])
+        with phase("parent_training"):
+            model_parent_one_info = fit_cached(weight_cache, model_parent_one, config_parent_one, train_data,
+                                               epochs=10, verbose=2, validation_data=test_data)
+            model_parent_two_info = fit_cached(weight_cache, model_parent_two, config_parent_two, train_data,
+                                               epochs=10, verbose=2, validation_data=test_data)
+
+        best_parent_loss = min(model_parent_one_info["val_loss"][-1], model_parent_two_info["val_loss"][-1])
 
         weights_parent_one = model_parent_one.get_weights()
         weights_parent_two = model_parent_two.get_weights()
 
-        # compute the cross correlation matrix
-        hidden_representation_offspring_one = get_hidden_layers(model_parent_one, x_test, batch_size_activation)
-        hidden_representation_offspring_two = get_hidden_layers(model_parent_two, x_test, batch_size_activation)
-
-        list_cross_corr = get_corr_cnn_filters(hidden_representation_offspring_one, hidden_representation_offspring_two)
-
-        for safety_level in ["safe_crossover", "naive_crossover"]:
-            weights_parent_one_copy = copy.deepcopy(weights_parent_one)
-            weights_parent_two_copy = copy.deepcopy(weights_parent_two)
-
-            # functionally align the networks
-            list_ordered_indices_one, list_ordered_indices_two, weights_offspring_one, weights_offspring_two = crossover_method(
-                weights_parent_one_copy, weights_parent_two_copy, list_cross_corr, safety_level)
+        # compute the cross correlation matrix (the weight matching alignment needs no forward pass)
+        if alignment == "activations":
+            list_cross_corr, _, _ = get_corr_matrices(model_parent_one, model_parent_two, activation_data,
+                                                      batch_size_activation, seed=work_id + epoch)
+        plan = get_permutation_plan(model_parent_one)
+        model_pool.release(model_parent_one, model_parent_two)
+
+        safety_levels = ["safe_crossover", "naive_crossover"]
+        list_weights_offspring = []
+        for safety_level in safety_levels:
+            # functionally align the networks (both alignments leave the parent weights untouched)
+            if alignment == "weights":
+                list_ordered_indices_one, list_ordered_indices_two, weights_offspring_one, weights_offspring_two = weight_matching_crossover(
+                    weights_parent_one, weights_parent_two, safety_level, plan, seed=work_id)
+            else:
+                list_ordered_indices_one, list_ordered_indices_two, weights_offspring_one, weights_offspring_two = crossover_method(
+                    weights_parent_one, weights_parent_two, list_cross_corr, safety_level, plan)
 
-            weights_offspring = arithmetic_crossover(weights_offspring_one, weights_offspring_two)
-            model_offspring = keras_model_cnn(0, data)
-            model_offspring.set_weights(weights_offspring)
+            with phase("blending"):
+                list_weights_offspring.append(arithmetic_crossover(weights_offspring_one, weights_offspring_two))
 
-            loss_after_crossover = model_offspring.evaluate(x_test, y_test)[0]
+        # every offspring is scored in the same pass over the test set
+        with phase("evaluation"):
+            evaluator = model_pool.ensemble(keras_model_cnn, data, len(list_weights_offspring))
+            list_scores = evaluator.evaluate(list_weights_offspring, test_data)
 
+        for safety_level, (loss_after_crossover, _) in zip(safety_levels, list_scores):
             improvement = ((loss_after_crossover - best_parent_loss) / best_parent_loss) * -100
-            result_list.append(improvement)
             print("IMPROVEMENT: ", safety_level, improvement)
 
-    keras.backend.clear_session()
-
-    return result_list
+            results_writer.append(work_id, crossover, safety_level, epoch, improvement=improvement,
+                                  timings=profiler.seconds())
+        results_writer.flush()
 
 
 def crossover_offspring(data, x_train, y_train, x_test, y_test, work_id=0):
-    # shuffle input data here
-
+    # the training data is shuffled by the input pipeline, seeded with work_id + 1
+    # the global generators are still seeded for the random draws of utils (match_random_filters)
     np.random.seed(work_id + 1)
-    shuffle_list = np.arange(x_train.shape[0])
-    np.random.shuffle(shuffle_list)
-    x_train = x_train[shuffle_list]
-    y_train = y_train[shuffle_list]
+    random.seed(work_id + 1)
+    profiler.work_id = work_id
 
     # program hyperparameters
     num_trainable_layer = 5
@@ -205,41 +397,53 @@ def crossover_offspring(data, x_train, y_train, x_test, y_test, work_id=0):
     batch_size_sgd = 128
 
     num_transplants = 1
+    num_candidates = 1  # random transplants scored per alignment in targeted_crossover_random
+    selection_epochs = 0  # successive halving budget of those candidates, 0 scores them untrained
+    patience = None  # early stopping patience of the 50 epoch trainings, None trains the full 50 epochs
+    probe_samples = None  # align on the first probe_samples test images only, None aligns on all of x_test
 
     # crossover = "targeted_crossover_low_corr"
     # crossover = "targeted_crossover_random"
     crossover = "arithmetic_crossover"
 
-    if crossover == "transplant_crossover":
-        result_list = transplant_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, num_trainable_layer,
-                                           batch_size_activation, batch_size_sgd, work_id)
-    else:
-        result_list = average_weights_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, batch_size_activation,
-                                                batch_size_sgd, work_id)
+    # alignment = "weights"
+    alignment = "activations"
 
-    return result_list
+    # the phases recorded before a crash are written as well
+    try:
+        if crossover == "transplant_crossover":
+            transplant_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, num_trainable_layer,
+                                 batch_size_activation, batch_size_sgd, work_id, num_candidates,
+                                 selection_epochs=selection_epochs, patience=patience, probe_samples=probe_samples)
+        else:
+            average_weights_crossover(crossover, data, x_train, y_train, x_test, y_test, num_transplants, batch_size_activation,
+                                      batch_size_sgd, work_id, alignment, patience)
+    finally:
+        profiler.flush()
 
 
 if __name__ == "__main__":
     
     data = "cifar10"
 
-    if data == "cifar10":
-        x_train, x_test, y_train, y_test = load_cifar()
-    elif data == "cifar100":
-        x_train, x_test, y_train, y_test = load_cifar_100()
-    elif data == "mnist":
-        x_train, x_test, y_train, y_test = load_mnist()
+    try:
+        with phase("data_load"):
+            x_train, x_test, y_train, y_test = load_dataset_store(data)
+    finally:
+        profiler.flush()
 
     num_processes = 1
+    num_pairs = num_processes
 
     start = timer()
 
-    pair_list = [pair for pair in range(num_processes)]
+    pair_list = [pair for pair in range(num_pairs)]
 
-    results = crossover_offspring(data, x_train, y_train, x_test, y_test, pair_list)
-
-    pickle.dump(results, open("crossover_results.pickle", "wb"))
+    if num_processes > 1:
+        run_parallel(crossover_offspring, data, [x_train, y_train, x_test, y_test], pair_list, num_processes)
+    else:
+        for work_id in pair_list:
+            crossover_offspring(data, x_train, y_train, x_test, y_test, work_id)
 
     end = timer()
     print(end - start)
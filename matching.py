@@ -0,0 +1,76 @@
+import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
+
+
+# Every engine takes a square score matrix, returns the (rows, cols) of a one-to-one matching that (approximately)
+# maximizes the total score, and an upper bound on how far that total is from the optimum. dense is exact; on wide
+# layers with unstructured scores, sparse_topk (usually still optimal) and greedy are the fast paths.
+
+
+def assignment_upper_bound(score):
+    # no matching can do better than giving every row (or every column) its best entry
+    return min(np.sum(np.max(score, axis=1)), np.sum(np.max(score, axis=0)))
+
+
+def matching_gap(score, rows, cols):
+    return max(assignment_upper_bound(score) - np.sum(score[rows, cols]), 0.0)
+
+
+def match_dense(score):
+    # exact Hungarian-type solver, O(N^3)
+    rows, cols = linear_sum_assignment(score, maximize=True)
+
+    return rows, cols, 0.0
+
+
+def match_greedy(score):
+    # rounds of mutually best pairs: each of them is the best remaining pair of its row and of its column, which gives
+    # the same matching as repeatedly picking the best remaining entry
+    num_neurons = score.shape[0]
+    cols = -np.ones(num_neurons, dtype=int)
+    free_rows = np.arange(num_neurons)
+    free_cols = np.arange(num_neurons)
+
+    while free_rows.size > 0:
+        sub_score = score[np.ix_(free_rows, free_cols)]
+        best_col = np.argmax(sub_score, axis=1)
+        best_row = np.argmax(sub_score, axis=0)
+        mutual = best_row[best_col] == np.arange(free_rows.size)
+
+        cols[free_rows[mutual]] = free_cols[best_col[mutual]]
+        taken_cols = np.zeros(free_cols.size, dtype=bool)
+        taken_cols[best_col[mutual]] = True
+        free_rows = free_rows[~mutual]
+        free_cols = free_cols[~taken_cols]
+
+    rows = np.arange(num_neurons)
+
+    return rows, cols, matching_gap(score, rows, cols)
+
+
+def match_sparse_topk(score, k=16):
+    # exact matching restricted to the k best columns of every row, the dense solver is the fallback when these
+    # candidate edges do not contain a full matching
+    num_neurons = score.shape[0]
+    k = min(k, num_neurons)
+
+    top_cols = np.argpartition(-score, k - 1, axis=1)[:, :k]
+    top_score = score[np.arange(num_neurons)[:, None], top_cols]
+
+    # every full matching has num_neurons edges, so shifting the weights to be strictly positive (the explicit zeros
+    # of a sparse matrix are missing edges) does not change which one is the best
+    weights = top_score - np.min(top_score) + 1.0
+    graph = csr_matrix((weights.ravel(), top_cols.ravel(), np.arange(0, num_neurons * k + 1, k)),
+                       shape=(num_neurons, num_neurons))
+
+    try:
+        rows, cols = min_weight_full_bipartite_matching(graph, maximize=True)
+    except ValueError:
+        return match_dense(score)
+
+    return rows, cols, matching_gap(score, rows, cols)
+
+
+MATCHING_ENGINES = {"dense": match_dense, "greedy": match_greedy, "sparse_topk": match_sparse_topk}
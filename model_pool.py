@@ -0,0 +1,67 @@
+import numpy as np
+import keras
+
+from ensemble_evaluation import EnsembleEvaluator
+
+
+def reset_optimizer(model):
+    # fresh optimizer state: zero moments, accumulators and iteration count
+    keras.backend.batch_set_value([(weight, np.zeros(keras.backend.int_shape(weight))) for weight in
+                                   model.optimizer.weights])
+
+
+class ModelPool:
+    """Built and compiled models, keyed by (architecture, dataset).
+
+    acquire hands out a model reset to the requested weights (or to the initial weights of a seed) with a fresh
+    optimizer state, and release puts it back, so graph construction and compilation happen once per process
+    instead of once per offspring.
+    """
+
+    def __init__(self):
+        self.free_models = {}
+        self.model_keys = {}
+        self.seed_weights = {}
+        self.ensembles = {}
+
+    def _add(self, key, model):
+        self.model_keys[id(model)] = key
+        self.free_models.setdefault(key, []).append(model)
+
+    def initial_weights(self, architecture, data, seed):
+        # the initializers are seeded, so the weights of a seed are drawn once and the model joins the pool
+        seed_key = (architecture.__name__, data, seed)
+        if seed_key not in self.seed_weights:
+            model = architecture(seed, data)
+            self.seed_weights[seed_key] = model.get_weights()
+            self._add((architecture.__name__, data), model)
+
+        return self.seed_weights[seed_key]
+
+    def acquire(self, architecture, data, weights=None, seed=0):
+        if weights is None:
+            weights = self.initial_weights(architecture, data, seed)
+
+        key = (architecture.__name__, data)
+        free_models = self.free_models.setdefault(key, [])
+        if free_models:
+            model = free_models.pop()
+        else:
+            model = architecture(seed, data)
+            self.model_keys[id(model)] = key
+
+        model.set_weights(weights)
+        reset_optimizer(model)
+
+        return model
+
+    def release(self, *models):
+        for model in models:
+            self.free_models[self.model_keys[id(model)]].append(model)
+
+    def ensemble(self, architecture, data, num_members):
+        key = (architecture.__name__, data, num_members)
+        if key not in self.ensembles:
+            self.ensembles[key] = EnsembleEvaluator(architecture, data, num_members)
+
+        return self.ensembles[key]
@@ -2,15 +2,24 @@ import keras
 
 
 class CustomSaver(keras.callbacks.Callback):
-    def __init__(self, epoch_list, parent_id, work_id):
+    def __init__(self, epoch_list, parent_id, work_id, writer=None):
         self.epoch_list = epoch_list
         self.parent_id = parent_id
         self.work_id = work_id
+        # with a checkpoint.AsyncCheckpointWriter the weights are written in the background instead of saving the model
+        self.writer = writer
 
     def on_epoch_end(self, epoch, logs={}):
         if epoch + 1 in self.epoch_list:
-            self.model.save("parents_trained/model_" + self.parent_id + "_epoch_" + str(epoch + 1) + "_" + str(
-                self.work_id) + ".hd5")
+            name = "model_" + self.parent_id + "_epoch_" + str(epoch + 1) + "_" + str(self.work_id)
+            if self.writer is None:
+                self.model.save("parents_trained/" + name + ".hd5")
+            else:
+                self.writer.submit(name, self.model.get_weights(), group=(self.parent_id, self.work_id))
+
+    def on_train_end(self, logs=None):
+        if self.writer is not None:
+            self.writer.flush()
 
 
 def lr_scheduler(epoch, learning_rate=0.1, lr_drop=20):
@@ -0,0 +1,86 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+
+# per worker process: the dataset arrays mapped on the parent's shared memory blocks
+_worker_arrays = None
+_worker_blocks = []
+
+
+def share_arrays(arrays):
+    blocks = []
+    specs = []
+    for array in arrays:
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        shared_array = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+        shared_array[...] = array
+
+        blocks.append(block)
+        specs.append((block.name, array.shape, array.dtype.str))
+
+    return blocks, specs
+
+
+def attach_arrays(specs):
+    arrays = []
+    for name, shape, dtype in specs:
+        block = shared_memory.SharedMemory(name=name)
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        array.flags.writeable = False
+
+        _worker_blocks.append(block)
+        arrays.append(array)
+
+    return arrays
+
+
+def _initialize_worker(specs, num_threads):
+    global _worker_arrays
+
+    # cap the thread pools before TensorFlow creates them so workers don't oversubscribe the cores
+    os.environ["OMP_NUM_THREADS"] = str(num_threads)
+    os.environ["TF_NUM_INTRAOP_THREADS"] = str(num_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    import tensorflow as tf
+    try:
+        tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+    except RuntimeError:
+        # the runtime is already initialized, the environment variables above still apply
+        pass
+
+    _worker_arrays = attach_arrays(specs)
+
+
+def _run_work_id(args):
+    function, data, work_id = args
+
+    return work_id, function(data, *_worker_arrays, work_id=work_id)
+
+
+def run_parallel(function, data, arrays, work_ids, num_processes, num_threads=None):
+    """Call function(data, *arrays, work_id=work_id) for every work_id on a pool of processes.
+
+    The arrays are copied once into shared memory and mapped read-only by every worker instead of being pickled to
+    each of them. The results are returned in the order of work_ids.
+    """
+
+    if num_threads is None:
+        num_threads = max(1, os.cpu_count() // num_processes)
+
+    blocks, specs = share_arrays(arrays)
+    try:
+        # TensorFlow is not fork-safe, the workers start from a fresh interpreter
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(num_processes, initializer=_initialize_worker, initargs=(specs, num_threads)) as pool:
+            results = dict(pool.imap_unordered(_run_work_id, [(function, data, work_id) for work_id in work_ids]))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    return [results[work_id] for work_id in work_ids]
@@ -0,0 +1,192 @@
+import collections
+
+import numpy as np
+import keras
+
+
+# every tensor touched by the neurons of one Conv2D/Dense layer: (tensor index, axis) pairs for the layer's own
+# kernel, bias and batch norm parameters, and the input axis of the kernel that consumes the layer. flatten_size is
+# the number of spatial positions when a Flatten sits between the layer and its consumer.
+NeuronLayer = collections.namedtuple("NeuronLayer", ["num_neurons", "out_tensors", "in_tensor", "in_axis",
+                                                     "flatten_size"])
+
+
+def axis_index(ndim, axis, indices):
+    return (slice(None),) * axis + (indices,) + (slice(None),) * (ndim - axis - 1)
+
+
+class PermutationPlan:
+    """Where each neuron axis of a network lives in its get_weights() list.
+
+    The plan is derived once per architecture; permutations and transplants are then applied as one fancy-index
+    gather per tensor, whatever the layout of the model (keras_model_cnn, keras_vgg, ...).
+    """
+
+    def __init__(self, layers):
+        self.layers = layers
+
+        # row offsets of the spatial positions in a flattened kernel: row = position * num_neurons + neuron
+        self.flatten_offsets = []
+        for layer in layers:
+            if layer.flatten_size is None:
+                self.flatten_offsets.append(None)
+            else:
+                self.flatten_offsets.append(np.arange(layer.flatten_size)[:, None] * layer.num_neurons)
+
+    @classmethod
+    def from_model(cls, model):
+        layers = []
+        pending = None
+        flatten = False
+        offset = 0
+
+        for layer in model.layers:
+            shapes = [keras.backend.int_shape(weight) for weight in layer.weights]
+
+            if isinstance(layer, keras.layers.convolutional.Conv2D) or isinstance(layer, keras.layers.Dense):
+                if pending is not None:
+                    flatten_size = shapes[0][0] // pending["num_neurons"] if flatten else None
+                    layers.append(NeuronLayer(pending["num_neurons"], pending["out_tensors"], offset,
+                                              len(shapes[0]) - 2, flatten_size))
+
+                out_tensors = [(offset, len(shapes[0]) - 1)] + [(offset + index, 0) for index in range(1, len(shapes))]
+                pending = {"num_neurons": shapes[0][-1], "out_tensors": out_tensors}
+                flatten = False
+
+            elif isinstance(layer, keras.layers.BatchNormalization) and pending is not None:
+                pending["out_tensors"] += [(offset + index, 0) for index in range(len(shapes))]
+
+            elif isinstance(layer, keras.layers.Flatten):
+                flatten = True
+
+            offset += len(shapes)
+
+        # the neurons of the output layer are never permuted
+        return cls(layers)
+
+    def _in_indices(self, layer, indices):
+        if self.flatten_offsets[layer] is None:
+            return indices
+
+        return (self.flatten_offsets[layer] + np.asarray(indices)[None, :]).ravel()
+
+    def permute(self, weights_list, list_permutation):
+        for layer in range(len(list_permutation)):
+            neuron_layer = self.layers[layer]
+            permutation = np.asarray(list_permutation[layer])
+
+            for tensor, axis in neuron_layer.out_tensors:
+                weights_list[tensor] = np.take(weights_list[tensor], permutation, axis=axis)
+
+            weights_list[neuron_layer.in_tensor] = np.take(weights_list[neuron_layer.in_tensor],
+                                                           self._in_indices(layer, permutation),
+                                                           axis=neuron_layer.in_axis)
+
+        return weights_list
+
+    def _transplant_indices(self, weights_list, layer, indices_transplant, indices_remove):
+        # (tensor, donor index, recipient index) of every slice moved by a transplant in layer
+        neuron_layer = self.layers[layer]
+        indices_transplant = np.asarray(indices_transplant, dtype=int)
+        indices_remove = np.asarray(indices_remove, dtype=int)
+
+        for tensor, axis in neuron_layer.out_tensors:
+            ndim = weights_list[tensor].ndim
+            yield tensor, axis_index(ndim, axis, indices_transplant), axis_index(ndim, axis, indices_remove)
+
+        tensor = neuron_layer.in_tensor
+        ndim = weights_list[tensor].ndim
+        yield (tensor, axis_index(ndim, neuron_layer.in_axis, self._in_indices(layer, indices_transplant)),
+               axis_index(ndim, neuron_layer.in_axis, self._in_indices(layer, indices_remove)))
+
+    def transplant(self, fittest_weights, weakest_weights, indices_transplant, indices_remove, layer):
+        for tensor, donor_index, recipient_index in self._transplant_indices(fittest_weights, layer, indices_transplant,
+                                                                             indices_remove):
+            fittest_weights[tensor][recipient_index] = weakest_weights[tensor][donor_index]
+
+        return fittest_weights
+
+    def transplant_both(self, weights_one, weights_two, list_transplant_one, list_remove_one, list_transplant_two,
+                        list_remove_two):
+        """Transplants in both directions and every layer, in place.
+
+        Network one receives the neurons list_transplant_one[layer] of network two at list_remove_one[layer], and
+        network two the neurons list_transplant_two[layer] of network one at list_remove_two[layer]. Every donor
+        slice is gathered from the untouched weights before anything is written, so no copy of either network is
+        needed; the slices are then written layer after layer, like a sequence of transplant calls on snapshots.
+        """
+
+        moves = []
+        for layer in range(len(list_transplant_one)):
+            for tensor, donor_index, recipient_index in self._transplant_indices(weights_one, layer,
+                                                                                 list_transplant_one[layer],
+                                                                                 list_remove_one[layer]):
+                moves.append((weights_one, tensor, recipient_index, weights_two[tensor][donor_index]))
+
+            for tensor, donor_index, recipient_index in self._transplant_indices(weights_two, layer,
+                                                                                 list_transplant_two[layer],
+                                                                                 list_remove_two[layer]):
+                moves.append((weights_two, tensor, recipient_index, weights_one[tensor][donor_index]))
+
+        for recipient_weights, tensor, recipient_index, donor_slice in moves:
+            recipient_weights[tensor][recipient_index] = donor_slice
+
+        return weights_one, weights_two
+
+    @staticmethod
+    def _neighbour_block(weights, neighbour_axis, neuron_axis, flatten_layer):
+        # weights as a contiguous (neighbour neurons, -1, neurons) array, the rows of a Flatten split into
+        # (positions, neurons) first
+        if flatten_layer.flatten_size is not None:
+            flat_axis = flatten_layer.in_axis
+            weights = weights.reshape(weights.shape[:flat_axis] + (flatten_layer.flatten_size, flatten_layer.num_neurons) +
+                                      weights.shape[flat_axis + 1:])
+            neighbour_axis, neuron_axis = [axis + 1 if axis >= flat_axis else axis for axis in (neighbour_axis, neuron_axis)]
+
+        weights = np.moveaxis(weights, [neighbour_axis, neuron_axis], [0, -1])
+
+        return np.ascontiguousarray(weights.reshape(weights.shape[0], -1, weights.shape[-1]))
+
+    def neuron_blocks(self, weights_list, layer):
+        """Every weight attached to the neurons of layer, split by the permutation it depends on.
+
+        Returns (fixed, incoming, outgoing). fixed has one row per neuron: bias, batch norm parameters and the kernels
+        whose other neuron axis is never permuted. incoming is the kernel of the layer as (previous layer neurons, -1,
+        neurons) and outgoing the kernel of its consumer as (next layer neurons, -1, neurons), so a permutation of a
+        neighbouring layer is a row gather on their first axis. incoming is None for the first layer and outgoing None
+        for the last one, their weights are part of fixed.
+        """
+
+        neuron_layer = self.layers[layer]
+        num_neurons = neuron_layer.num_neurons
+        fixed = [np.moveaxis(weights_list[tensor], axis, 0).reshape(num_neurons, -1) for tensor, axis in
+                 neuron_layer.out_tensors[1:]]
+
+        tensor, axis = neuron_layer.out_tensors[0]
+        incoming = None
+        if layer == 0:
+            fixed.append(np.moveaxis(weights_list[tensor], axis, 0).reshape(num_neurons, -1))
+        else:
+            previous_layer = self.layers[layer - 1]
+            incoming = self._neighbour_block(weights_list[tensor], previous_layer.in_axis, axis, previous_layer)
+
+        weights = weights_list[neuron_layer.in_tensor]
+        outgoing = self._neighbour_block(weights, weights.ndim - 1, neuron_layer.in_axis, neuron_layer)
+        if layer + 1 == len(self.layers):
+            fixed.append(outgoing.reshape(-1, num_neurons).T)
+            outgoing = None
+
+        return np.concatenate(fixed, axis=1), incoming, outgoing
+
+
+_plan_cache = {}
+
+
+def get_permutation_plan(model):
+    # one plan per architecture, keyed on the layer types and weight shapes
+    key = tuple((type(layer).__name__, tuple(keras.backend.int_shape(weight) for weight in layer.weights))
+                for layer in model.layers)
+    if key not in _plan_cache:
+        _plan_cache[key] = PermutationPlan.from_model(model)
+
+    return _plan_cache[key]
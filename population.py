@@ -0,0 +1,135 @@
+import numpy as np
+
+from correlation import draw_positions
+from correlation import sample_positions
+from profiling import phase
+from utils import bipartite_matching
+from utils import iter_hidden_layers
+
+
+class ReferenceAligner:
+    """Aligns the members of a population to one reference network.
+
+    The activations of the reference are captured once, at fixed sampled positions, and kept standardized per layer;
+    every member is then correlated with these cached samples and permuted into the neuron order of the reference.
+    All aligned members share that ordering, so any pair of them can be blended or transplanted without another
+    matching, and aligning P networks costs P activation passes instead of P^2.
+
+    data_x must yield its batches in the same order on every pass (a make_dataset pipeline without seed, or an array).
+    dtype is the activation capture dtype, as in utils.get_corr_matrices.
+    """
+
+    def __init__(self, reference_model, data_x, batch_size, num_positions=1, seed=None, dtype=None):
+        self.data_x = data_x
+        self.batch_size = batch_size
+        self.dtype = dtype
+        self.num_positions = num_positions
+        rng = np.random.default_rng(seed)
+
+        self.positions = []
+        batches = []
+        with phase("reference_statistics"):
+            for hidden_layers in iter_hidden_layers(reference_model, data_x, batch_size, dtype):
+                # the last two tapped layers (the dense layers) are not aligned
+                hidden_layers = hidden_layers[:-2]
+                positions = [draw_positions(hidden_layer, num_positions, rng) for hidden_layer in hidden_layers]
+                self.positions.append(positions)
+                batches.append([sample_positions(hidden_layer, layer_positions).astype(np.float64) for
+                                hidden_layer, layer_positions in zip(hidden_layers, positions)])
+
+            self.num_samples = [sum(batch[index].shape[0] for batch in batches) for index in range(len(batches[0]))]
+            mean = [sum(batch[index].sum(axis=0) for batch in batches) / self.num_samples[index] for index in
+                    range(len(self.num_samples))]
+            std = [np.sqrt(sum(np.square(batch[index] - mean[index]).sum(axis=0) for batch in batches) /
+                           self.num_samples[index]) for index in range(len(self.num_samples))]
+
+            # zero-variance neurons get a zero column, i.e. a correlation of 0 with everything
+            inverse_std = [np.divide(1, layer_std, out=np.zeros_like(layer_std), where=layer_std > 0) for layer_std in
+                           std]
+            self.standardized = [[((batch[index] - mean[index]) * inverse_std[index]).astype(np.float32) for index in
+                                  range(len(batch))] for batch in batches]
+
+            self.self_corr = []
+            for index in range(len(self.num_samples)):
+                gram = sum(batch[index].T.astype(np.float64) @ batch[index] for batch in self.standardized)
+                self.self_corr.append(gram / self.num_samples[index])
+
+    def correlate(self, model):
+        # cross correlation (rows: reference, columns: model) and self correlation of the model, in one pass
+        num_layers = len(self.num_samples)
+        sum_cross = [0] * num_layers
+        shift = [None] * num_layers
+        sum_member = [0] * num_layers
+        sum_member_member = [0] * num_layers
+
+        for batch_id, hidden_layers in enumerate(iter_hidden_layers(model, self.data_x, self.batch_size, self.dtype)):
+            with phase("correlation"):
+                for index in range(num_layers):
+                    member = sample_positions(hidden_layers[index], self.positions[batch_id][index]).astype(np.float64)
+
+                    # the standardized reference columns sum to zero, so the member samples need no centering here
+                    sum_cross[index] = sum_cross[index] + self.standardized[batch_id][index].T @ member
+
+                    if shift[index] is None:
+                        shift[index] = member.mean(axis=0)
+                    member -= shift[index]
+                    sum_member[index] = sum_member[index] + member.sum(axis=0)
+                    sum_member_member[index] = sum_member_member[index] + member.T @ member
+
+        list_cross_corr = []
+        list_self_corr = []
+        with phase("correlation"):
+            for index in range(num_layers):
+                num_samples = self.num_samples[index]
+                mean = sum_member[index] / num_samples
+                covariance = sum_member_member[index] / num_samples - np.outer(mean, mean)
+                std = np.sqrt(np.maximum(np.diag(covariance), 0))
+
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    cross_corr = sum_cross[index] / (num_samples * std[None, :])
+                    self_corr = covariance / np.outer(std, std)
+                cross_corr[~np.isfinite(cross_corr)] = 0
+                self_corr[~np.isfinite(self_corr)] = 0
+
+                list_cross_corr.append(cross_corr)
+                list_self_corr.append(self_corr)
+
+        return list_cross_corr, list_self_corr
+
+    def align(self, model, plan, crossover="safe_crossover", engine="dense"):
+        """Weights of model permuted into the neuron order of the reference.
+
+        Returns the permutations, the permuted weights, and the cross correlation with the reference and the self
+        correlation of the model, both re-ordered to match the permuted weights.
+        """
+
+        list_cross_corr, list_self_corr = self.correlate(model)
+
+        with phase("matching"):
+            list_permutation = [np.asarray(bipartite_matching(cross_corr, crossover, engine)[1]) for cross_corr in
+                                list_cross_corr]
+
+        with phase("permutation"):
+            weights = plan.permute(model.get_weights(), list_permutation)
+
+        list_cross_corr = [cross_corr[:, permutation] for cross_corr, permutation in
+                           zip(list_cross_corr, list_permutation)]
+        list_self_corr = [self_corr[np.ix_(permutation, permutation)] for self_corr, permutation in
+                          zip(list_self_corr, list_permutation)]
+
+        return list_permutation, weights, list_cross_corr, list_self_corr
+
+
+def align_population(models, plan, data_x, batch_size, reference_index=0, crossover="safe_crossover", engine="dense",
+                     num_positions=1, seed=None):
+    # weights of every model in the neuron order of models[reference_index]; the reference is returned unchanged
+    aligner = ReferenceAligner(models[reference_index], data_x, batch_size, num_positions, seed)
+
+    list_weights = []
+    for index, model in enumerate(models):
+        if index == reference_index:
+            list_weights.append(model.get_weights())
+        else:
+            list_weights.append(aligner.align(model, plan, crossover, engine)[1])
+
+    return list_weights
@@ -0,0 +1,82 @@
+import contextlib
+import json
+import os
+import resource
+import sys
+import time
+
+
+def peak_rss_mb():
+    # high-water mark of the process since it started (ru_maxrss is in kilobytes on Linux and in bytes on macOS)
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak_rss / 2 ** 20
+
+    return peak_rss / 2 ** 10
+
+
+def current_rss_mb():
+    # resident set size right now, None where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm_file:
+            resident_pages = int(statm_file.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+
+
+class PhaseProfiler:
+    """Wall time, call count and memory growth of every pipeline phase, per work_id.
+
+    rss_growth_mb is the largest increase of the current RSS over one call of the phase, so it can be attributed to
+    that phase; process_peak_rss_mb is the high-water mark of the whole process when the phase last ended, which
+    later phases inherit. Timing a phase costs two perf_counter calls and two reads of /proc, so the profiler stays
+    on in production runs. flush appends one JSON record per (work_id, phase) to path; every record is a single
+    append so parallel workers can share the file.
+    """
+
+    def __init__(self, path="phase_profile.jsonl"):
+        self.path = path
+        self.work_id = None
+        self.records = {}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_rss = current_rss_mb()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            end_rss = current_rss_mb()
+
+            record = self.records.get((self.work_id, name))
+            if record is None:
+                record = {"work_id": self.work_id, "phase": name, "calls": 0, "seconds": 0.0, "max_seconds": 0.0}
+                self.records[(self.work_id, name)] = record
+
+            record["calls"] += 1
+            record["seconds"] += elapsed
+            record["max_seconds"] = max(record["max_seconds"], elapsed)
+            if start_rss is not None and end_rss is not None:
+                record["rss_growth_mb"] = max(record.get("rss_growth_mb", 0.0), end_rss - start_rss)
+            record["process_peak_rss_mb"] = peak_rss_mb()
+
+    def seconds(self):
+        # time spent so far in every phase of the current work_id
+        return {name: record["seconds"] for (work_id, name), record in self.records.items() if
+                work_id == self.work_id}
+
+    def flush(self):
+        with open(self.path, "a") as profile_file:
+            for record in self.records.values():
+                record = dict(record, pid=os.getpid(), time=time.time())
+                profile_file.write(json.dumps(record) + "\n")
+                profile_file.flush()
+        self.records = {}
+
+
+# one profiler per process
+profiler = PhaseProfiler()
+phase = profiler.phase
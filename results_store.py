@@ -0,0 +1,120 @@
+import json
+import os
+import tempfile
+import time
+
+import numpy as np
+
+
+# scalar columns of every record; val_loss is a ragged column stored as values + offsets
+COLUMNS = {"work_id": np.int64, "crossover": str, "safety_level": str, "transplant": np.int64, "network": np.int64,
+           "improvement": np.float64, "timings": str}
+
+
+class ResultsWriter:
+    """Append-only columnar results, one shard file per flush.
+
+    Records are buffered in memory and flush writes them as a new .npz shard (one array per column) under a name unique
+    to the writer process, atomically, so parallel workers append to the same directory without any locking and a run
+    that dies only loses its unflushed records.
+    """
+
+    def __init__(self, directory="results"):
+        self.directory = directory
+        self.records = []
+        self.num_shards = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def append(self, work_id, crossover, safety_level, transplant, network=-1, val_loss=(), improvement=np.nan,
+               timings=None):
+        self.records.append({"work_id": work_id, "crossover": crossover, "safety_level": safety_level,
+                             "transplant": transplant, "network": network, "improvement": improvement,
+                             "timings": json.dumps(timings or {}), "val_loss": np.asarray(val_loss, dtype=np.float64)})
+
+    def flush(self):
+        if not self.records:
+            return
+
+        columns = {name: np.array([record[name] for record in self.records], dtype=dtype) for name, dtype in
+                   COLUMNS.items()}
+        columns["val_loss"] = np.concatenate([record["val_loss"] for record in self.records])
+        columns["val_loss_offsets"] = np.cumsum([0] + [record["val_loss"].size for record in self.records])
+
+        name = "%d-%d-%d.npz" % (os.getpid(), time.time_ns(), self.num_shards)
+        write_atomic(os.path.join(self.directory, name), np.savez, **columns)
+
+        self.num_shards += 1
+        self.records = []
+
+
+def write_atomic(path, save, *args, **kwargs):
+    # save(file, *args, **kwargs) (np.save, np.savez) into a temp file renamed over path, so readers never see a partial
+    # file; a failed write removes its temp file
+    file_descriptor, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(file_descriptor, "wb") as tmp_file:
+            save(tmp_file, *args, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def list_shards(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith(".npz"))
+
+
+def read_results(directory="results", columns=None, **filters):
+    """Records of every shard in directory whose scalar columns equal the filters (a value or a list of values).
+
+    Only the requested columns (all by default) are returned, as one array per column; val_loss is a list with one
+    array per record.
+    """
+
+    if columns is None:
+        columns = list(COLUMNS) + ["val_loss"]
+
+    parts = {name: [] for name in columns}
+    for path in list_shards(directory):
+        with np.load(path, allow_pickle=False) as shard:
+            # the filter columns are read first, the other columns only for shards with matching records
+            mask = np.ones(shard["work_id"].shape[0], dtype=bool)
+            for name, value in filters.items():
+                mask &= np.isin(shard[name], np.atleast_1d(value))
+            if not np.any(mask):
+                continue
+
+            for name in columns:
+                if name == "val_loss":
+                    offsets = shard["val_loss_offsets"]
+                    values = shard["val_loss"]
+                    parts[name].extend(values[offsets[index]:offsets[index + 1]] for index in np.flatnonzero(mask))
+                else:
+                    parts[name].append(shard[name][mask])
+
+    results = {}
+    for name in columns:
+        if name == "val_loss":
+            results[name] = parts[name]
+        elif parts[name]:
+            results[name] = np.concatenate(parts[name])
+        else:
+            results[name] = np.array([], dtype=COLUMNS[name])
+
+    return results
+
+
+def compact(directory="results"):
+    # merge every shard into one, for faster reads once the runs are finished
+    shards = list_shards(directory)
+    if len(shards) < 2:
+        return
+
+    results = read_results(directory)
+    columns = {name: results[name] for name in COLUMNS}
+    columns["val_loss"] = np.concatenate(results["val_loss"]) if results["val_loss"] else np.array([], dtype=np.float64)
+    columns["val_loss_offsets"] = np.cumsum([0] + [values.size for values in results["val_loss"]])
+
+    write_atomic(os.path.join(directory, "%d-%d-compact.npz" % (os.getpid(), time.time_ns())), np.savez, **columns)
+    for path in shards:
+        os.remove(path)
@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def synthetic_cnn(width, rng, num_conv_layers=4, kernel_size=3, flatten_positions=4, dense_size=16, output_size=10):
+    # weight list and permutation plan laid out like keras_model_cnn: conv kernel, bias and 4 batch norm tensors per
+    # block, then the flattened dense layer and the output layer without bias
+    # imported here, so that the test modules can skip before keras is needed
+    from permutation_plan import NeuronLayer
+    from permutation_plan import PermutationPlan
+
+    weights_list = []
+    layers = []
+    in_channels = 3
+    for layer in range(num_conv_layers):
+        offset = len(weights_list)
+        weights_list.append(rng.standard_normal((kernel_size, kernel_size, in_channels, width)))
+        weights_list += [rng.standard_normal(width) for _ in range(5)]
+        in_channels = width
+
+        flatten_size = flatten_positions if layer == num_conv_layers - 1 else None
+        in_axis = 0 if layer == num_conv_layers - 1 else 2
+        layers.append(NeuronLayer(width, [(offset, 3)] + [(offset + index, 0) for index in range(1, 6)], offset + 6,
+                                  in_axis, flatten_size))
+
+    offset = len(weights_list)
+    weights_list.append(rng.standard_normal((flatten_positions * width, dense_size)))
+    weights_list.append(rng.standard_normal(dense_size))
+    weights_list.append(rng.standard_normal((dense_size, output_size)))
+    layers.append(NeuronLayer(dense_size, [(offset, 1), (offset + 1, 0)], offset + 2, 0, None))
+
+    return weights_list, PermutationPlan(layers)
+
+
+@pytest.fixture
+def cnn():
+    return synthetic_cnn
@@ -0,0 +1,112 @@
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip("keras")
+pytest.importorskip("tensorflow")
+
+from utils import identify_interesting_neurons
+
+
+def reference_identify_interesting_neurons(list_cross_corr, list_self_corr_one, list_self_corr_two):
+    # the implementation before the rewrite on masks and running maxima, without its prints
+    indices_neurons_low_corr = []
+    indices_neurons_redundant = []
+
+    for index in range(len(list_cross_corr)):
+
+        self_corr_two = copy.deepcopy(list_self_corr_two[index])
+        self_corr_two = np.abs(self_corr_two)
+        np.fill_diagonal(self_corr_two, -0.1)
+
+        self_corr_one = copy.deepcopy(list_self_corr_one[index])
+        self_corr_one = np.abs(self_corr_one)
+        np.fill_diagonal(self_corr_one, -0.1)
+
+        cross_corr = copy.deepcopy(list_cross_corr[index])
+
+        list_neurons_remove = []
+        list_neurons_transplant = []
+
+        for _ in range(self_corr_one.shape[0]):
+            redundant_corr = np.max(np.max(self_corr_one, axis=1))
+            index_remove = np.argmax(np.max(self_corr_one, axis=1))
+
+            self_corr_one = np.delete(self_corr_one, index_remove, 0)
+            self_corr_one = np.delete(self_corr_one, index_remove, 1)
+            cross_corr = np.delete(cross_corr, index_remove, 0)
+
+            range_indices = np.arange(0, self_corr_one.shape[0], 1)
+            transplant_corr = np.max(np.abs(cross_corr), axis=0)
+            zipped_list = list(zip(transplant_corr, range_indices))
+            zipped_list.sort()
+            indices = [val[1] for val in zipped_list]
+            untransplanted_neurons = [index for index in indices if index not in list_neurons_transplant]
+
+            if len(untransplanted_neurons) > 0:
+                index_transplant = untransplanted_neurons[0]
+
+                if redundant_corr < transplant_corr[indices.index(index_transplant)]:
+                    break
+            else:
+                break
+
+            cross_corr_array = cross_corr[:, index_transplant]
+            self_corr_one = np.insert(self_corr_one, index_remove, cross_corr_array, axis=0)
+            cross_corr_array = np.insert(cross_corr_array, index_remove, -0.1)
+            self_corr_one = np.insert(self_corr_one, index_remove, cross_corr_array, axis=1)
+
+            cross_corr = np.insert(cross_corr, index_transplant, self_corr_two[index_transplant, :], axis=0)
+
+            list_neurons_remove.append(index_remove)
+            list_neurons_transplant.append(index_transplant)
+
+        indices_neurons_low_corr.append(list_neurons_transplant)
+        indices_neurons_redundant.append(list_neurons_remove)
+
+    return indices_neurons_low_corr, indices_neurons_redundant
+
+
+def correlation_matrices(num_neurons, rng, num_factors=4, decimals=None):
+    # two networks whose neurons are driven by a few shared factors, so that some of them are redundant
+    factors = rng.standard_normal((8 * num_neurons, num_factors))
+    activations_one = factors @ rng.standard_normal((num_factors, num_neurons)) + rng.standard_normal(
+        (8 * num_neurons, num_neurons))
+    activations_two = factors @ rng.standard_normal((num_factors, num_neurons)) + rng.standard_normal(
+        (8 * num_neurons, num_neurons))
+
+    corr = np.corrcoef(activations_one, activations_two, rowvar=False)
+    if decimals is not None:
+        # coarse values, so that the selection runs into ties
+        corr = np.round(corr, decimals)
+
+    return corr[:num_neurons, num_neurons:], corr[:num_neurons, :num_neurons], corr[num_neurons:, num_neurons:]
+
+
+@pytest.mark.parametrize("num_neurons", [2, 8, 32, 64])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("decimals", [None, 1])
+def test_matches_reference(num_neurons, seed, decimals):
+    rng = np.random.default_rng(seed)
+    list_cross_corr, list_self_corr_one, list_self_corr_two = zip(
+        *[correlation_matrices(num_neurons, rng, decimals=decimals) for _ in range(3)])
+
+    expected = reference_identify_interesting_neurons(list_cross_corr, list_self_corr_one, list_self_corr_two)
+    result = identify_interesting_neurons(list_cross_corr, list_self_corr_one, list_self_corr_two)
+
+    assert [[int(index) for index in indices] for indices in result[0]] == [
+        [int(index) for index in indices] for indices in expected[0]]
+    assert [[int(index) for index in indices] for indices in result[1]] == [
+        [int(index) for index in indices] for indices in expected[1]]
+
+
+def test_leaves_inputs_unchanged():
+    list_cross_corr, list_self_corr_one, list_self_corr_two = [[matrix] for matrix in
+                                                               correlation_matrices(16, np.random.default_rng(0))]
+    copies = [matrix.copy() for matrix in list_cross_corr + list_self_corr_one + list_self_corr_two]
+
+    identify_interesting_neurons(list_cross_corr, list_self_corr_one, list_self_corr_two)
+
+    for matrix, matrix_copy in zip(list_cross_corr + list_self_corr_one + list_self_corr_two, copies):
+        np.testing.assert_array_equal(matrix, matrix_copy)
@@ -0,0 +1,63 @@
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip("keras")
+pytest.importorskip("tensorflow")
+
+from utils import permute_cnn
+
+
+def reference_permute_cnn(weights_list_copy, list_permutation):
+    # the implementation before the permutation plan, hard-wired to the keras_model_cnn layout
+    depth = 0
+    for layer in range(len(list_permutation)):
+        for index in range(7):
+            if index == 0:
+                weights_list_copy[index + depth] = weights_list_copy[index + depth][:, :, :, list_permutation[layer]]
+            elif index in [1, 2, 3, 4, 5]:
+                weights_list_copy[index + depth] = weights_list_copy[index + depth][list_permutation[layer]]
+            elif index == 6:
+                if (index + depth) != (len(weights_list_copy) - 3):
+                    weights_list_copy[index + depth] = weights_list_copy[index + depth][:, :, list_permutation[layer],
+                                                       :]
+                else:
+                    num_filters = len(list_permutation[layer])
+                    weights_tmp = copy.deepcopy(weights_list_copy[index + depth])
+                    activation_map_size = int(weights_tmp.shape[0] / num_filters)
+
+                    for i in range(num_filters):
+                        filter_id = list_permutation[layer][i]
+                        weights_list_copy[index + depth][[num_filters * j + i for j in range(activation_map_size)]] = \
+                            weights_tmp[[num_filters * j + filter_id for j in range(activation_map_size)]]
+
+        depth = (layer + 1) * 6
+
+    return weights_list_copy
+
+
+@pytest.mark.parametrize("width", [1, 8, 64])
+@pytest.mark.parametrize("seed", [0, 1])
+def test_matches_reference(cnn, width, seed):
+    rng = np.random.default_rng(seed)
+    weights_list, plan = cnn(width, rng)
+    list_permutation = [rng.permutation(width) for _ in range(4)]
+
+    expected = reference_permute_cnn([weights.copy() for weights in weights_list], list_permutation)
+    result = permute_cnn(list(weights_list), list_permutation, plan)
+
+    assert len(result) == len(expected)
+    for weights, expected_weights in zip(result, expected):
+        np.testing.assert_array_equal(weights, expected_weights)
+
+
+def test_leaves_input_tensors_unchanged(cnn):
+    rng = np.random.default_rng(0)
+    weights_list, plan = cnn(8, rng)
+    copies = [weights.copy() for weights in weights_list]
+
+    permute_cnn(list(weights_list), [rng.permutation(8) for _ in range(4)], plan)
+
+    for weights, weights_copy in zip(weights_list, copies):
+        np.testing.assert_array_equal(weights, weights_copy)
@@ -0,0 +1,112 @@
+import copy
+
+import numpy as np
+import pytest
+
+pytest.importorskip("keras")
+pytest.importorskip("tensorflow")
+
+from utils import transplant_all_neurons
+from utils import transplant_neurons
+
+
+def reference_transplant_neurons(fittest_weights, weakest_weights, indices_transplant, indices_remove, layer, depth):
+    # the implementation before the permutation plan, hard-wired to the keras_model_cnn layout with 64 filters. It
+    # compared index == [1, 2, 3, 4, 5], which never holds, so the biases and batch norm parameters were not moved;
+    # that is fixed here as it is in the plan
+    weakest_weights_copy = copy.deepcopy(weakest_weights)
+
+    for index in range(7):
+        if index == 0:
+            fittest_weights[index + depth][:, :, :, indices_remove[layer]] = weakest_weights_copy[index + depth][:, :, :,
+                                                                             indices_transplant[layer]]
+        elif index in [1, 2, 3, 4, 5]:
+            fittest_weights[index + depth][indices_remove[layer]] = weakest_weights_copy[index + depth][
+                indices_transplant[layer]]
+        elif index == 6:
+            if (index + depth) != (len(fittest_weights) - 3):
+                fittest_weights[index + depth][:, :, indices_remove[layer], :] = weakest_weights_copy[index + depth][:, :,
+                                                                                 indices_transplant[layer], :]
+            else:
+                num_filters = 64
+                activation_map_size = int(weakest_weights_copy[index + depth].shape[0] / num_filters)
+
+                for i in range(len(indices_transplant[layer])):
+                    filter_id_transplant = indices_transplant[layer][i]
+                    filter_id_remove = indices_remove[layer][i]
+                    fittest_weights[index + depth][
+                        [num_filters * j + filter_id_remove for j in range(activation_map_size)]] = weakest_weights_copy[index + depth][
+                        [num_filters * j + filter_id_transplant for j in range(activation_map_size)]]
+
+    return fittest_weights
+
+
+def reference_transplant_all(weights_one, weights_two, indices_transplant_one, indices_remove_one,
+                             indices_transplant_two, indices_remove_two, num_layers):
+    # the sequence transplant_crossover ran before transplant_all_neurons: both directions from deep copies
+    weights_one_tmp = copy.deepcopy(weights_one)
+    weights_two_tmp = copy.deepcopy(weights_two)
+
+    depth = 0
+    for layer in range(num_layers):
+        weights_one = reference_transplant_neurons(weights_one, weights_two_tmp, indices_transplant_one,
+                                                   indices_remove_one, layer, depth)
+        weights_two = reference_transplant_neurons(weights_two, weights_one_tmp, indices_transplant_two,
+                                                   indices_remove_two, layer, depth)
+        depth = (layer + 1) * 6
+
+    return weights_one, weights_two
+
+
+def transplant_indices(rng, width=64, num_layers=4, num_transplants=16):
+    return [[rng.choice(width, num_transplants, replace=False) for _ in range(num_layers)] for _ in range(4)]
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_matches_snapshot_sequence(cnn, seed):
+    rng = np.random.default_rng(seed)
+    weights_one, plan = cnn(64, rng)
+    weights_two, _ = cnn(64, rng)
+    indices = transplant_indices(rng)
+
+    expected_one, expected_two = reference_transplant_all([weights.copy() for weights in weights_one],
+                                                          [weights.copy() for weights in weights_two], *indices, 4)
+    result_one, result_two = transplant_all_neurons(weights_one, weights_two, *indices, 4, plan)
+
+    for weights, expected_weights in zip(result_one + result_two, expected_one + expected_two):
+        np.testing.assert_array_equal(weights, expected_weights)
+
+
+def test_moves_biases_and_batch_norm(cnn):
+    rng = np.random.default_rng(0)
+    weights_one, plan = cnn(64, rng)
+    weights_two, _ = cnn(64, rng)
+    original_one = [weights.copy() for weights in weights_one]
+    original_two = [weights.copy() for weights in weights_two]
+    indices_transplant_one, indices_remove_one, indices_transplant_two, indices_remove_two = transplant_indices(rng)
+
+    transplant_all_neurons(weights_one, weights_two, indices_transplant_one, indices_remove_one, indices_transplant_two,
+                           indices_remove_two, 4, plan)
+
+    for layer in range(4):
+        for tensor in range(6 * layer + 1, 6 * layer + 6):
+            np.testing.assert_array_equal(weights_one[tensor][indices_remove_one[layer]],
+                                          original_two[tensor][indices_transplant_one[layer]])
+            np.testing.assert_array_equal(weights_two[tensor][indices_remove_two[layer]],
+                                          original_one[tensor][indices_transplant_two[layer]])
+
+
+def test_transplant_neurons_matches_reference_layer(cnn):
+    rng = np.random.default_rng(0)
+    weights_one, plan = cnn(64, rng)
+    weights_two, _ = cnn(64, rng)
+    indices_transplant, indices_remove = transplant_indices(rng)[:2]
+
+    for layer in range(4):
+        expected = reference_transplant_neurons([weights.copy() for weights in weights_one], weights_two,
+                                                indices_transplant, indices_remove, layer, 6 * layer)
+        result = transplant_neurons([weights.copy() for weights in weights_one], weights_two, indices_transplant,
+                                    indices_remove, layer, plan)
+
+        for weights, expected_weights in zip(result, expected):
+            np.testing.assert_array_equal(weights, expected_weights)
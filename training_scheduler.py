@@ -0,0 +1,86 @@
+import numpy as np
+import keras
+
+
+def early_stopping(patience=10, min_delta=0.0):
+    # stop once val_loss has not improved for patience epochs and go back to the best weights
+    return keras.callbacks.EarlyStopping(monitor="val_loss", min_delta=min_delta, patience=patience,
+                                         restore_best_weights=True)
+
+
+def fit_early_stopping(model, train_data, validation_data, epochs, patience=None, **fit_kwargs):
+    # model.fit for at most epochs epochs; the history holds one val_loss per epoch actually trained
+    # the early stopping goes first, so the other callbacks see the restored best weights when training ends
+    callbacks = list(fit_kwargs.pop("callbacks", []))
+    if patience is not None:
+        callbacks.insert(0, early_stopping(patience))
+
+    return model.fit(train_data, epochs=epochs, validation_data=validation_data, callbacks=callbacks,
+                     **fit_kwargs).history
+
+
+def has_converged(val_loss, patience, min_delta=0.0):
+    # no improvement of more than min_delta over the best loss in the last patience epochs
+    if len(val_loss) <= patience:
+        return False
+
+    return min(val_loss[-patience:]) > min(val_loss[:-patience]) - min_delta
+
+
+def test_loss_callback(model, test_data, test_losses):
+    # loss on test_data after every epoch, kept apart from the validation set that drives the ranking
+    return keras.callbacks.LambdaCallback(
+        on_epoch_end=lambda epoch, logs: test_losses.append(float(model.evaluate(test_data, verbose=0)[0])))
+
+
+def successive_halving(models, train_data, validation_data, max_epochs, min_epochs=1, eta=2, patience=None,
+                       test_data=None, **fit_kwargs):
+    """Trains a population of compiled models under a shared budget.
+
+    Every model is trained for min_epochs, then only the best 1 / eta of them (by their last val_loss) go on for eta
+    times more epochs, and so on until max_epochs. A model whose val_loss has not improved for patience epochs stops
+    training but keeps its place in the ranking. Returns the indices of the models still in the race, best first,
+    and one history per model with every epoch it was trained for. With test_data, the histories also hold the
+    test_loss of every epoch, so the curve of the winner can be recorded like the one of a plain fit.
+    """
+
+    callbacks = list(fit_kwargs.pop("callbacks", []))
+    histories = [{} for _ in models]
+    active = list(range(len(models)))
+    converged = set()
+    epochs_done = 0
+    rung_epochs = min_epochs
+
+    def last_loss(index):
+        return histories[index]["val_loss"][-1]
+
+    while True:
+        target_epochs = min(rung_epochs, max_epochs)
+
+        for index in active:
+            if index in converged:
+                continue
+
+            model_callbacks = callbacks
+            if test_data is not None:
+                model_callbacks = callbacks + [test_loss_callback(models[index], test_data,
+                                                                  histories[index].setdefault("test_loss", []))]
+
+            history = models[index].fit(train_data, initial_epoch=epochs_done, epochs=target_epochs,
+                                        validation_data=validation_data, callbacks=model_callbacks,
+                                        **fit_kwargs).history
+            for metric, values in history.items():
+                histories[index].setdefault(metric, []).extend(values)
+
+            if patience is not None and has_converged(histories[index]["val_loss"], patience):
+                converged.add(index)
+
+        epochs_done = target_epochs
+        active = sorted(active, key=last_loss)
+        if epochs_done >= max_epochs or all(index in converged for index in active):
+            break
+
+        active = active[:max(1, int(np.ceil(len(active) / eta)))]
+        rung_epochs *= eta
+
+    return active, histories
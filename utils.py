@@ -1,25 +1,64 @@
 import numpy as np
-from scipy.optimize import linear_sum_assignment
 import keras
-import copy
+import tensorflow as tf
+import concurrent.futures
 import random
+import weakref
 
+from correlation import CorrelationAccumulator
+from input_pipeline import make_dataset
+from matching import MATCHING_ENGINES
+from profiling import phase
+from weight_vector import WeightVector
 
-def get_hidden_layers(model, data_x, batch_size):
-    data_x = data_x[:batch_size]
 
-    def keras_function_layer(model_layer, data):
-        hidden_func = keras.backend.function(model.layers[0].input, model_layer.output)
-        result = hidden_func([data])
+# multi-output extractors per model and capture dtype, built the first time those activations are requested
+_extractor_cache = weakref.WeakKeyDictionary()
 
-        return result
 
-    hidden_layers_list = []
-    for index in range(len(model.layers)):
-        if isinstance(model.layers[index], keras.layers.convolutional.Conv2D) or isinstance(model.layers[index],
-                                                                                            keras.layers.Dense):
-            hidden_layer = keras_function_layer(model.layers[index], data_x)
-            hidden_layers_list.append(hidden_layer)
+def get_activation_extractor(model, dtype=None):
+    # with a dtype ("float16", "bfloat16") the activations are cast inside the graph, so the captured maps take
+    # half the memory of the float32 ones
+    extractors = _extractor_cache.setdefault(model, {})
+    if dtype not in extractors:
+        tapped_layers = [layer for layer in model.layers if isinstance(layer, keras.layers.convolutional.Conv2D) or
+                         isinstance(layer, keras.layers.Dense)]
+        outputs = [layer.output for layer in tapped_layers]
+        if dtype is not None:
+            outputs = [keras.layers.Lambda(lambda output: keras.backend.cast(output, dtype))(output) for output in
+                       outputs]
+        extractors[dtype] = keras.models.Model(inputs=model.layers[0].input, outputs=outputs)
+
+    return extractors[dtype]
+
+
+def iter_hidden_layers(model, data_x, batch_size, dtype=None):
+    # a single forward pass per batch returns the activations of every Conv2D/Dense layer
+    # data_x is an image array or a batched input pipeline from input_pipeline.make_dataset
+    extractor = get_activation_extractor(model, dtype)
+    if not isinstance(data_x, tf.data.Dataset):
+        data_x = make_dataset(data_x, batch_size=batch_size)
+
+    for batch_x in data_x:
+        with phase("activation_extraction"):
+            hidden_layers_list = extractor.predict_on_batch(batch_x)
+        if not isinstance(hidden_layers_list, list):
+            hidden_layers_list = [hidden_layers_list]
+
+        yield [np.asarray(hidden_layer) for hidden_layer in hidden_layers_list]
+
+
+def get_hidden_layers(model, data_x, batch_size, num_samples=None, dtype=None):
+    if num_samples is None:
+        num_samples = batch_size
+    if isinstance(data_x, tf.data.Dataset):
+        data_x = data_x.unbatch().take(num_samples).batch(batch_size)
+    else:
+        data_x = data_x[:num_samples]
+
+    batches = list(iter_hidden_layers(model, data_x, batch_size, dtype))
+    hidden_layers_list = [np.concatenate([batch[index] for batch in batches], axis=0) for index in
+                          range(len(batches[0]))]
 
     return hidden_layers_list
 
@@ -46,61 +85,101 @@ def compute_neurons_variance(hidden_layers_list):
     return list_variance_filters
 
 
+def identify_layer_neurons(cross_corr, self_corr_one, self_corr_two):
+    num_neurons_one, num_neurons_two = cross_corr.shape
+
+    self_corr_two = np.abs(self_corr_two)
+    np.fill_diagonal(self_corr_two, -0.1)
+
+    self_corr_one = np.abs(self_corr_one)
+    np.fill_diagonal(self_corr_one, -0.1)
+    row_max = np.max(self_corr_one, axis=1)
+
+    # the rows of the cross correlation matrix live in a preallocated buffer (room for one inserted row per
+    # iteration); row_order lists the active buffer rows in matrix order, so removing or inserting a row is a
+    # list operation instead of a reallocation of the whole matrix
+    cross_corr_buffer = np.empty((2 * num_neurons_one, num_neurons_two))
+    cross_corr_buffer[:num_neurons_one] = cross_corr
+    abs_cross_corr_buffer = np.abs(cross_corr_buffer)
+    active_rows = np.zeros(2 * num_neurons_one, dtype=bool)
+    active_rows[:num_neurons_one] = True
+    row_order = list(range(num_neurons_one))
+    next_row = num_neurons_one
+
+    # maximum absolute correlation of every neuron of network two and the buffer row it comes from
+    transplant_corr = np.max(abs_cross_corr_buffer[:num_neurons_one], axis=0)
+    transplant_corr_row = np.argmax(abs_cross_corr_buffer[:num_neurons_one], axis=0)
+    transplanted = np.zeros(num_neurons_two, dtype=bool)
+
+    list_neurons_remove = []
+    list_neurons_transplant = []
+
+    for _ in range(num_neurons_one):
+        index_remove = int(np.argmax(row_max))
+        redundant_corr = row_max[index_remove]
+
+        removed_row = row_order.pop(index_remove)
+        active_rows[removed_row] = False
+        stale_columns = np.flatnonzero(transplant_corr_row == removed_row)
+        if stale_columns.size > 0:
+            remaining_rows = np.flatnonzero(active_rows)
+            stale_block = abs_cross_corr_buffer[remaining_rows][:, stale_columns]
+            transplant_corr[stale_columns] = np.max(stale_block, axis=0)
+            transplant_corr_row[stale_columns] = remaining_rows[np.argmax(stale_block, axis=0)]
+
+        # only the first num_neurons_one - 1 neurons of network two are candidates, as they always have been
+        candidate_corr = transplant_corr[:num_neurons_one - 1]
+        if transplanted[:num_neurons_one - 1].all():
+            break
+
+        # least correlated neuron of network two that has not been transplanted yet (lowest index on ties)
+        index_transplant = int(np.argmin(np.where(transplanted[:num_neurons_one - 1], np.inf, candidate_corr)))
+        value_transplant = candidate_corr[index_transplant]
+        rank_transplant = np.count_nonzero(candidate_corr < value_transplant) + np.count_nonzero(
+            candidate_corr[:index_transplant] == value_transplant)
+
+        # the stopping threshold is read at the candidate's rank in the sorted order, as the selection always has
+        if redundant_corr < transplant_corr[rank_transplant]:
+            break
+
+        # the transplanted neuron takes the place of the removed one in self_corr_one
+        cross_corr_array = np.insert(cross_corr_buffer[row_order, index_transplant], index_remove, -0.1)
+        previous_column = self_corr_one[:, index_remove].copy()
+        self_corr_one[index_remove, :] = cross_corr_array
+        self_corr_one[:, index_remove] = cross_corr_array
+
+        stale_rows = (previous_column == row_max) & (cross_corr_array < previous_column)
+        row_max = np.maximum(row_max, cross_corr_array)
+        stale_rows[index_remove] = False
+        row_max[stale_rows] = np.max(self_corr_one[stale_rows], axis=1)
+        row_max[index_remove] = np.max(cross_corr_array)
+
+        # update cross correlation
+        cross_corr_buffer[next_row] = self_corr_two[index_transplant, :]
+        abs_cross_corr_buffer[next_row] = np.abs(self_corr_two[index_transplant, :])
+        active_rows[next_row] = True
+        row_order.insert(index_transplant, next_row)
+
+        larger = abs_cross_corr_buffer[next_row] > transplant_corr
+        transplant_corr[larger] = abs_cross_corr_buffer[next_row][larger]
+        transplant_corr_row[larger] = next_row
+        next_row += 1
+
+        transplanted[index_transplant] = True
+        list_neurons_remove.append(index_remove)
+        list_neurons_transplant.append(index_transplant)
+
+    return list_neurons_transplant, list_neurons_remove
+
+
 def identify_interesting_neurons(list_cross_corr, list_self_corr_one, list_self_corr_two):
     indices_neurons_low_corr = []
     indices_neurons_redundant = []
 
     for index in range(len(list_cross_corr)):
-
-        self_corr_two = copy.deepcopy(list_self_corr_two[index])
-        self_corr_two = np.abs(self_corr_two)
-        np.fill_diagonal(self_corr_two, -0.1)
-
-        self_corr_one = copy.deepcopy(list_self_corr_one[index])
-        self_corr_one = np.abs(self_corr_one)
-        np.fill_diagonal(self_corr_one, -0.1)
-
-        cross_corr = copy.deepcopy(list_cross_corr[index])
-
-        list_neurons_remove = []
-        list_neurons_transplant = []
-
-        for _ in range(self_corr_one.shape[0]):
-            redundant_corr = np.max(np.max(self_corr_one, axis=1))
-            index_remove = np.argmax(np.max(self_corr_one, axis=1))
-
-            # update new self_corr_one
-            self_corr_one = np.delete(self_corr_one, index_remove, 0)
-            self_corr_one = np.delete(self_corr_one, index_remove, 1)
-            cross_corr = np.delete(cross_corr, index_remove, 0)
-
-            range_indices = np.arange(0, self_corr_one.shape[0], 1)
-            transplant_corr = np.max(np.abs(cross_corr), axis=0)
-            zipped_list = list(zip(transplant_corr, range_indices))
-            zipped_list.sort()
-            indices = [val[1] for val in zipped_list]
-            untransplanted_neurons = [index for index in indices if index not in list_neurons_transplant]
-
-            if len(untransplanted_neurons) > 0:
-                index_transplant = untransplanted_neurons[0]
-                #  print(redundant_corr, transplant_corr[indices.index(index_transplant)])
-
-                if redundant_corr < transplant_corr[indices.index(index_transplant)]:
-                    break
-            else:
-                break
-
-            # index_transplant = np.argmin(np.max(np.abs(cross_corr), axis=0))
-            cross_corr_array = cross_corr[:, index_transplant]
-            self_corr_one = np.insert(self_corr_one, index_remove, cross_corr_array, axis=0)
-            cross_corr_array = np.insert(cross_corr_array, index_remove, -0.1)
-            self_corr_one = np.insert(self_corr_one, index_remove, cross_corr_array, axis=1)
-
-            # update cross correlation
-            cross_corr = np.insert(cross_corr, index_transplant, self_corr_two[index_transplant, :], axis=0)
-
-            list_neurons_remove.append(index_remove)
-            list_neurons_transplant.append(index_transplant)
+        list_neurons_transplant, list_neurons_remove = identify_layer_neurons(list_cross_corr[index],
+                                                                              list_self_corr_one[index],
+                                                                              list_self_corr_two[index])
 
         indices_neurons_low_corr.append(list_neurons_transplant)
         indices_neurons_redundant.append(list_neurons_remove)
@@ -127,153 +206,141 @@ def match_random_filters(q_value_list, list_cross_corr):
     return filters_to_transplant, filters_to_remove
 
 
-def get_corr_cnn_filters(hidden_representation_list_one, hidden_representation_list_two):
-    list_corr_matrices = []
+def random_filter_candidates(q_value_list, list_cross_corr, num_candidates, rng):
+    # match_random_filters for num_candidates offspring at once: per layer, (num_candidates, num_filters_to_change)
+    # arrays of distinct indices drawn from range(num_filters), taken from the argsort of uniform noise
+    filters_to_remove = []
+    filters_to_transplant = []
 
-    for layer_id in range(len(hidden_representation_list_one) - 2):
+    for index in range(len(q_value_list)):
+        num_filters = int(list_cross_corr[index].shape[0]*q_value_list[index])
+        num_filters_to_change = int(num_filters * q_value_list[index])
+        indices_to_remove = np.argsort(rng.random((num_candidates, num_filters)), axis=1)[:, :num_filters_to_change]
+        indices_to_transplant = np.argsort(rng.random((num_candidates, num_filters)), axis=1)[:, :num_filters_to_change]
 
-        batch_size = hidden_representation_list_one[layer_id].shape[0]
-        size_activation_map = hidden_representation_list_one[layer_id].shape[1]
-        num_filters = hidden_representation_list_one[layer_id].shape[-1]
+        filters_to_remove.append(indices_to_remove)
+        filters_to_transplant.append(indices_to_transplant)
 
-        # draw a random value from each of the CNN filters
-        i_dim = np.random.choice(range(0, size_activation_map), batch_size)
-        j_dim = np.random.choice(range(0, size_activation_map), batch_size)
+    return filters_to_transplant, filters_to_remove
 
-        layer_one = []
-        layer_two = []
-        for index in range(batch_size):
-            layer_one.append(hidden_representation_list_one[layer_id][index][i_dim[index], j_dim[index], :])
-            layer_two.append(hidden_representation_list_two[layer_id][index][i_dim[index], j_dim[index], :])
 
-        layer_one = np.array(layer_one)
-        layer_two = np.array(layer_two)
+def transplant_candidates(weights, donor_weights, indices_transplant, indices_remove, plan):
+    # one offspring per candidate of random_filter_candidates, all held in one (num_candidates, num_weights) float32
+    # array; returns that array and a WeightVector view on each of its rows
+    base = WeightVector.from_weights(weights)
+    num_candidates = indices_transplant[0].shape[0]
+    stacked_weights = np.repeat(base.buffer[None, :], num_candidates, axis=0)
+
+    candidates = [WeightVector(stacked_weights[candidate], base.shapes) for candidate in range(num_candidates)]
+    for candidate, offspring in enumerate(candidates):
+        for layer in range(len(indices_transplant)):
+            plan.transplant(offspring.tensors, donor_weights, indices_transplant[layer][candidate],
+                            indices_remove[layer][candidate], layer)
 
-        cross_corr_matrix = np.corrcoef(layer_one, layer_two, rowvar=False)[num_filters:, :num_filters]
+    return stacked_weights, candidates
 
-        cross_corr_matrix[np.isnan(cross_corr_matrix)] = 0
-        list_corr_matrices.append(cross_corr_matrix)
 
-    return list_corr_matrices
+def get_corr_cnn_filters(hidden_representation_list_one, hidden_representation_list_two, num_positions=1,
+                         seed=None):
+    # the last two tapped layers (the dense layers) are not aligned
+    accumulator = CorrelationAccumulator(num_positions, seed)
+    accumulator.update(hidden_representation_list_one[:-2], hidden_representation_list_two[:-2])
+
+    return accumulator.cross_correlation()
+
+
+def get_corr_matrices(model_one, model_two, data_x, batch_size, num_positions=1, seed=None, dtype=None):
+    # stream both networks over data_x and return the cross and self correlation matrices of the convolutional layers
+    # the activations are captured in dtype (float32 by default) and the moments are accumulated in float64
+    accumulator = CorrelationAccumulator(num_positions, seed)
+    for hidden_layers_one, hidden_layers_two in zip(iter_hidden_layers(model_one, data_x, batch_size, dtype),
+                                                    iter_hidden_layers(model_two, data_x, batch_size, dtype)):
+        with phase("correlation"):
+            accumulator.update(hidden_layers_one[:-2], hidden_layers_two[:-2])
+
+    with phase("correlation"):
+        list_cross_corr = accumulator.cross_correlation()
+        list_self_corr_one = accumulator.self_correlation_one()
+        list_self_corr_two = accumulator.self_correlation_two()
+
+    return list_cross_corr, list_self_corr_one, list_self_corr_two
 
 
 # cross correlation function for both bipartite matching (hungarian method)
-def bipartite_matching(corr_matrix_nn, crossover="safe_crossover"):
-    corr_matrix_nn_tmp = copy.deepcopy(corr_matrix_nn)
+def bipartite_matching(corr_matrix_nn, crossover="safe_crossover", engine="dense", return_gap=False):
+    # every crossover is turned into a score to maximize, solved by one of the matching.MATCHING_ENGINES
     if crossover == "unsafe_crossover":
-        list_neurons_x, list_neurons_y = linear_sum_assignment(corr_matrix_nn_tmp)
+        score = -corr_matrix_nn
     elif crossover == "safe_crossover":
-        corr_matrix_nn_tmp *= -1  # default of linear_sum_assignement is to minimize cost, we want to max "cost"
-        list_neurons_x, list_neurons_y = linear_sum_assignment(corr_matrix_nn_tmp)
+        score = corr_matrix_nn
     elif crossover == "orthogonal_crossover":
-        corr_matrix_nn_tmp = np.abs(corr_matrix_nn_tmp)
-        list_neurons_x, list_neurons_y = linear_sum_assignment(corr_matrix_nn_tmp)
+        score = -np.abs(corr_matrix_nn)
     elif crossover == "normed_crossover":
-        corr_matrix_nn_tmp = np.abs(corr_matrix_nn_tmp)
-        corr_matrix_nn_tmp *= -1
-        list_neurons_x, list_neurons_y = linear_sum_assignment(corr_matrix_nn_tmp)
+        score = np.abs(corr_matrix_nn)
     elif crossover == "naive_crossover":
-        list_neurons_x, list_neurons_y = list(range(corr_matrix_nn_tmp.shape[0])), list(range(corr_matrix_nn_tmp.shape[0]))
+        list_neurons_x, list_neurons_y = list(range(corr_matrix_nn.shape[0])), list(range(corr_matrix_nn.shape[0]))
+        if return_gap:
+            return list_neurons_x, list_neurons_y, 0.0
+        return list_neurons_x, list_neurons_y
     else:
         raise ValueError('the crossover method is not defined')
 
+    if engine not in MATCHING_ENGINES:
+        raise ValueError('the matching engine is not defined')
+
+    list_neurons_x, list_neurons_y, gap = MATCHING_ENGINES[engine](score)
+
+    if return_gap:
+        return list_neurons_x, list_neurons_y, gap
     return list_neurons_x, list_neurons_y
 
 
 # Algorithm 2
-def permute_cnn(weights_list_copy, list_permutation):
-    depth = 0
-    for layer in range(len(list_permutation)):
-        for index in range(7):
-            if index == 0:
-                # order filters
-                weights_list_copy[index + depth] = weights_list_copy[index + depth][:, :, :, list_permutation[layer]]
-            elif index in [1, 2, 3, 4, 5]:
-                # order the biases and the batch norm parameters
-                weights_list_copy[index + depth] = weights_list_copy[index + depth][list_permutation[layer]]
-            elif index == 6:
-                if (index + depth) != (len(weights_list_copy) - 3):
-                    # order channels
-                    weights_list_copy[index + depth] = weights_list_copy[index + depth][:, :, list_permutation[layer],
-                                                       :]
-                else:  # this is for the flattened fully connected layer
-
-                    num_filters = len(list_permutation[layer])
-                    weights_tmp = copy.deepcopy(weights_list_copy[index + depth])
-                    activation_map_size = int(weights_tmp.shape[0] / num_filters)
-
-                    for i in range(num_filters):
-                        filter_id = list_permutation[layer][i]
-                        weights_list_copy[index + depth][[num_filters * j + i for j in range(activation_map_size)]] = \
-                            weights_tmp[[num_filters * j + filter_id for j in range(activation_map_size)]]
-
-        depth = (layer + 1) * 6
-
-    return weights_list_copy
-
-
-def transplant_neurons(fittest_weights, weakest_weights, indices_transplant, indices_remove, layer, depth):
-
-    weakest_weights_copy = copy.deepcopy(weakest_weights)
-
-    for index in range(7):
-        if index == 0:
-            # order filters
-            fittest_weights[index + depth][:, :, :, indices_remove[layer]] = weakest_weights_copy[index + depth][:, :, :,
-                                                                             indices_transplant[layer]]
-        elif index == [1, 2, 3, 4, 5]:
-            # order the biases and the batch norm parameters
-            fittest_weights[index + depth][indices_remove[layer]] = weakest_weights_copy[index + depth][
-                indices_transplant[layer]]
-        elif index == 6:
-            if (index + depth) != (len(fittest_weights) - 3):
-                # order channels
-                fittest_weights[index + depth][:, :, indices_remove[layer], :] = weakest_weights_copy[index + depth][:, :,
-                                                                                 indices_transplant[layer], :]
-            else:  # this is for the flattened fully connected layer
-
-                num_filters = 64
-                activation_map_size = int(weakest_weights_copy[index + depth].shape[0] / num_filters)
-
-                for i in range(len(indices_transplant[layer])):
-                    filter_id_transplant = indices_transplant[layer][i]
-                    filter_id_remove = indices_remove[layer][i]
-                    fittest_weights[index + depth][
-                        [num_filters * j + filter_id_remove for j in range(activation_map_size)]] = weakest_weights_copy[index + depth][
-                        [num_filters * j + filter_id_transplant for j in range(activation_map_size)]]
-
-    return fittest_weights
+def permute_cnn(weights_list_copy, list_permutation, plan):
+    return plan.permute(weights_list_copy, list_permutation)
 
 
-def arithmetic_crossover(fittest_weights, weakest_weights, t=0.5):
+def transplant_neurons(fittest_weights, weakest_weights, indices_transplant, indices_remove, layer, plan):
+    return plan.transplant(fittest_weights, weakest_weights, indices_transplant[layer], indices_remove[layer], layer)
+
 
-    array_one = np.array(fittest_weights)
-    array_two = np.array(weakest_weights)
+def transplant_all_neurons(weights_one, weights_two, indices_transplant_one, indices_remove_one, indices_transplant_two,
+                           indices_remove_two, num_layers, plan):
+    # transplant_neurons in both directions for the first num_layers layers, without copying either network
+    return plan.transplant_both(weights_one, weights_two, indices_transplant_one[:num_layers],
+                                indices_remove_one[:num_layers], indices_transplant_two[:num_layers],
+                                indices_remove_two[:num_layers])
 
-    # the scale factor is to keep the same variance
-    # scale_factor = np.sqrt(1 / (np.power(t, 2) + np.power(1 - t, 2)))
-    scale_factor = 1
-    new_weights = (t * array_one + (1 - t) * array_two) * scale_factor
 
-    return new_weights
+def arithmetic_crossover(fittest_weights, weakest_weights, t=0.5):
+    # fittest_weights and weakest_weights are weight lists or WeightVectors; the blend runs over one float32 buffer
+    # the scale factor that keeps the same variance would be np.sqrt(1 / (np.power(t, 2) + np.power(1 - t, 2)))
+    if isinstance(fittest_weights, WeightVector):
+        offspring = fittest_weights.copy()
+    else:
+        offspring = WeightVector.from_weights(fittest_weights)
+
+    offspring.blend(weakest_weights, t)
 
+    return offspring.tensors
 
-def crossover_method(weights_one, weights_two, list_corr_matrices, crossover):
 
-    list_ordered_indices_one = []
-    list_ordered_indices_two = []
+def crossover_method(weights_one, weights_two, list_corr_matrices, crossover, plan, engine="dense", num_threads=None):
 
-    for index in range(len(list_corr_matrices)):
-        corr_matrix_nn = list_corr_matrices[index]
+    # the layers are matched independently of each other, on a thread pool
+    with phase("matching"):
+        with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+            list_matchings = list(executor.map(lambda corr_matrix_nn: bipartite_matching(corr_matrix_nn, crossover, engine),
+                                               list_corr_matrices))
 
-        indices_one, indices_two = bipartite_matching(corr_matrix_nn, crossover)
-        list_ordered_indices_one.append(indices_one)
-        list_ordered_indices_two.append(indices_two)
+        list_ordered_indices_one = [matching[0] for matching in list_matchings]
+        list_ordered_indices_two = [matching[1] for matching in list_matchings]
 
-    weights_nn_one_copy = list(weights_one)
-    weights_nn_two_copy = list(weights_two)
-    list_ordered_w_one = permute_cnn(weights_nn_one_copy, list_ordered_indices_one)
-    list_ordered_w_two = permute_cnn(weights_nn_two_copy, list_ordered_indices_two)
+    with phase("permutation"):
+        weights_nn_one_copy = list(weights_one)
+        weights_nn_two_copy = list(weights_two)
+        list_ordered_w_one = permute_cnn(weights_nn_one_copy, list_ordered_indices_one, plan)
+        list_ordered_w_two = permute_cnn(weights_nn_two_copy, list_ordered_indices_two, plan)
 
     return list_ordered_indices_one, list_ordered_indices_two, list_ordered_w_one, list_ordered_w_two
 
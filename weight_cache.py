@@ -0,0 +1,87 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from results_store import write_atomic
+
+
+def config_key(config):
+    # content address of a training configuration (architecture, seeds, dataset, epochs, optimizer, ...)
+    encoded = json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class WeightCache:
+    """On-disk cache of trained weights and their training history, keyed by config_key.
+
+    Entries are written atomically so parallel workers can share a directory, and the least recently used entries are
+    evicted once the directory grows beyond max_bytes.
+    """
+
+    def __init__(self, directory="parents_cache", max_bytes=20 * 2 ** 30):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def load(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as archive:
+                history = json.loads(str(archive["history"]))
+                weights = [archive["arr_" + str(index)] for index in range(len(archive.files) - 1)]
+            os.utime(path)
+        except (FileNotFoundError, OSError, ValueError, KeyError):
+            return None
+
+        return weights, history
+
+    def store(self, key, weights, history):
+        history = {metric: [float(value) for value in values] for metric, values in history.items()}
+
+        write_atomic(self._path(key), np.savez, *weights, history=json.dumps(history))
+
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total_size = sum(entry[1] for entry in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total_size -= size
+
+
+def fit_cached(cache, model, config, *fit_args, **fit_kwargs):
+    # train model, or restore its weights if this configuration was already trained; returns the history dict
+    key = config_key(config)
+
+    cached = cache.load(key)
+    if cached is not None:
+        weights, history = cached
+        model.set_weights(weights)
+        print("loaded cached weights " + key)
+
+        return history
+
+    history = model.fit(*fit_args, **fit_kwargs).history
+    cache.store(key, model.get_weights(), history)
+
+    return history
@@ -0,0 +1,65 @@
+import numpy as np
+from scipy.linalg import blas
+
+
+class WeightVector:
+    """The weights of a model in one contiguous float32 buffer.
+
+    tensors holds one view per get_weights() entry, so the list can be handed to set_weights directly; blending,
+    permuting and transplanting write into the buffer in place.
+    """
+
+    def __init__(self, buffer, shapes):
+        self.buffer = buffer
+        self.shapes = [tuple(shape) for shape in shapes]
+
+        sizes = [int(np.prod(shape)) for shape in self.shapes]
+        self.offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+        self.tensors = [buffer[self.offsets[index]:self.offsets[index + 1]].reshape(self.shapes[index]) for index in
+                        range(len(self.shapes))]
+
+    @classmethod
+    def from_weights(cls, weights_list):
+        shapes = [np.shape(weights) for weights in weights_list]
+        buffer = np.empty(sum(int(np.prod(shape)) for shape in shapes), dtype=np.float32)
+
+        weight_vector = cls(buffer, shapes)
+        weight_vector.assign(weights_list)
+
+        return weight_vector
+
+    def __len__(self):
+        return len(self.tensors)
+
+    def copy(self):
+        return WeightVector(self.buffer.copy(), self.shapes)
+
+    def assign(self, weights_list):
+        for tensor, weights in zip(self.tensors, weights_list):
+            tensor[...] = weights
+
+    def blend(self, other, t=0.5):
+        # self = t * self + (1 - t) * other, without temporaries
+        blas.sscal(t, self.buffer)
+
+        if isinstance(other, WeightVector):
+            blas.saxpy(other.buffer, self.buffer, a=1 - t)
+        else:
+            for tensor, weights in zip(self.tensors, other):
+                blas.saxpy(np.ascontiguousarray(weights, dtype=np.float32).ravel(), tensor.ravel(), a=1 - t)
+
+        return self
+
+    def permute(self, plan, list_permutation):
+        permuted = plan.permute(list(self.tensors), list_permutation)
+        for tensor, weights in zip(self.tensors, permuted):
+            if weights is not tensor:
+                tensor[...] = weights
+
+        return self
+
+    def transplant(self, donor_weights, plan, indices_transplant, indices_remove, layer):
+        donor_tensors = donor_weights.tensors if isinstance(donor_weights, WeightVector) else donor_weights
+        plan.transplant(self.tensors, donor_tensors, indices_transplant, indices_remove, layer)
+
+        return self